@@ -0,0 +1,123 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    # Caps admitted requests at max_in_flight and waiting ones at
+    # max_queued. Waiters are kept per client and granted round-robin, so
+    # one client with many uploads cannot starve the others;
+    # per_client_limit bounds a client's admitted plus waiting requests.
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_queued: int,
+        per_client_limit: int,
+        queue_timeout_s: float,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.per_client_limit = per_client_limit
+        self.queue_timeout_s = queue_timeout_s
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = {429: 0, 503: 0}
+        self._client_jobs: dict[str, int] = {}
+        self._waiters: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+        # Running estimate of job duration for Retry-After.
+        self._job_seconds = 30.0
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self._job_seconds * (self.queued + 1) / self.max_in_flight))
+
+    def _reject(self, status_code: int, reason: str):
+        self.rejected[status_code] += 1
+        raise AdmissionRejected(status_code, reason, self.retry_after())
+
+    def _add_client_job(self, client_id: str, delta: int):
+        count = self._client_jobs.get(client_id, 0) + delta
+        if count > 0:
+            self._client_jobs[client_id] = count
+        else:
+            self._client_jobs.pop(client_id, None)
+
+    def _grant_waiters(self):
+        while self.in_flight < self.max_in_flight and self._waiters:
+            client_id, waiters = self._waiters.popitem(last=False)
+            future = waiters.popleft()
+            if waiters:
+                self._waiters[client_id] = waiters
+            self.queued -= 1
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _remove_waiter(self, client_id: str, future: asyncio.Future):
+        waiters = self._waiters.get(client_id)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del self._waiters[client_id]
+            self.queued -= 1
+
+    async def _acquire(self, client_id: str):
+        if self._client_jobs.get(client_id, 0) >= self.per_client_limit:
+            self._reject(429, f"Client {client_id} has too many jobs")
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            self._add_client_job(client_id, 1)
+            return
+        if self.queued >= self.max_queued:
+            self._reject(503, "Server is at capacity")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(client_id, deque()).append(future)
+        self.queued += 1
+        self._add_client_job(client_id, 1)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout_s)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done():
+                # Granted a slot just as the wait ended; hand it back.
+                self.in_flight -= 1
+                self._grant_waiters()
+            else:
+                future.cancel()
+                self._remove_waiter(client_id, future)
+            self._add_client_job(client_id, -1)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject(503, "Timed out waiting for a free slot")
+
+    def _release(self, client_id: str, elapsed: float):
+        self._job_seconds = 0.8 * self._job_seconds + 0.2 * elapsed
+        self.in_flight -= 1
+        self._add_client_job(client_id, -1)
+        self._grant_waiters()
+
+    @asynccontextmanager
+    async def admit(self, client_id: str):
+        await self._acquire(client_id)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(client_id, time.monotonic() - started)
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "clients": dict(self._client_jobs),
+            "rejected": dict(self.rejected),
+        }
@@ -0,0 +1,242 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+from main import CACHE_DIR, PIPELINE_STAGES
+from profiling import PROFILE_ENABLED, log_summary, profiler
+from scheduler import PipelineScheduler
+
+MANIFEST_NAME = "batch_manifest.sqlite"
+
+
+class BatchManifest:
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+        self._conn = sqlite3.connect(manifest_path, check_same_thread=False)
+        # Pipelined runs record stages from several worker threads.
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS stages (
+                    creative TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    artifact TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (creative, stage)
+                )
+                """
+            )
+
+    def reset(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM stages")
+
+    def is_done(self, creative: str, stage: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, artifact FROM stages WHERE creative = ? AND stage = ?",
+                (creative, stage),
+            ).fetchone()
+        return row is not None and row[0] == "done" and os.path.exists(row[1] or "")
+
+    def record(
+        self,
+        creative: str,
+        stage: str,
+        status: str,
+        artifact: str | None = None,
+        error: str | None = None,
+    ):
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO stages (creative, stage, status, artifact, error, attempts, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (creative, stage) DO UPDATE SET
+                    status = excluded.status,
+                    artifact = COALESCE(excluded.artifact, stages.artifact),
+                    error = excluded.error,
+                    attempts = stages.attempts + excluded.attempts,
+                    updated_at = excluded.updated_at
+                """,
+                (
+                    creative,
+                    stage,
+                    status,
+                    artifact,
+                    error,
+                    int(status == "running"),
+                    time.time(),
+                ),
+            )
+
+    def invalidate(self, creative: str, stages: list[str]):
+        # Stages downstream of one that reruns must rerun too, or resume
+        # would keep outputs built from the previous upstream artifacts.
+        if not stages:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"""
+                UPDATE stages SET status = 'stale', updated_at = ?
+                WHERE creative = ? AND stage IN ({", ".join("?" * len(stages))})
+                """,
+                (time.time(), creative, *stages),
+            )
+
+    def summary(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM stages GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+
+def _creative_id(image_path: str) -> str:
+    # The file name keeps output directories readable; the path hash keeps
+    # same-named creatives from different folders apart.
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    path_hash = hashlib.sha1(os.path.abspath(image_path).encode("utf-8")).hexdigest()
+    return f"{name}-{path_hash[:10]}"
+
+
+def _downstream(stage_name: str) -> list[str]:
+    names = [name for name, _ in PIPELINE_STAGES]
+    return names[names.index(stage_name) + 1 :]
+
+
+def run_creative(manifest: BatchManifest, image_path: str, output_root: str) -> bool:
+    creative = _creative_id(image_path)
+    output_dir = os.path.join(output_root, creative)
+    os.makedirs(output_dir, exist_ok=True)
+
+    for stage_name, stage in PIPELINE_STAGES:
+        if manifest.is_done(creative, stage_name):
+            continue
+        manifest.invalidate(creative, _downstream(stage_name))
+        manifest.record(creative, stage_name, "running")
+        try:
+            artifact = stage(image_path, output_dir)
+        except Exception as e:
+            logger.exception(f"{creative}: stage {stage_name} failed")
+            manifest.record(creative, stage_name, "failed", error=repr(e))
+            return False
+        manifest.record(creative, stage_name, "done", artifact=artifact)
+    return True
+
+
+def run_pipelined(
+    manifest: BatchManifest, image_paths: list[str], output_root: str
+) -> list[str]:
+    def creative(output_dir: str) -> str:
+        return os.path.basename(output_dir)
+
+    def on_event(output_dir: str, stage: str, status: str, **kwargs):
+        # A creative reaches its next stage only after this event, so the
+        # invalidation is seen by should_skip downstream.
+        if status == "running":
+            manifest.invalidate(creative(output_dir), _downstream(stage))
+        manifest.record(creative(output_dir), stage, status, **kwargs)
+
+    scheduler = PipelineScheduler(
+        should_skip=lambda output_dir, stage: manifest.is_done(creative(output_dir), stage),
+        on_event=on_event,
+    )
+    return scheduler.run(
+        [
+            (image_path, os.path.join(output_root, _creative_id(image_path)))
+            for image_path in image_paths
+        ]
+    )
+
+
+def run_batch(
+    image_paths: list[str],
+    output_root: str = CACHE_DIR,
+    manifest_path: str | None = None,
+    resume: bool = False,
+    pipelined: bool = False,
+    profile: bool = PROFILE_ENABLED,
+    profile_top_n: int = 10,
+) -> dict[str, int]:
+    os.makedirs(output_root, exist_ok=True)
+    if profile:
+        profiler.start()
+    manifest = BatchManifest(manifest_path or os.path.join(output_root, MANIFEST_NAME))
+    if not resume:
+        manifest.reset()
+
+    if pipelined:
+        failed = len(run_pipelined(manifest, image_paths, output_root))
+    else:
+        failed = 0
+        for i, image_path in enumerate(image_paths, start=1):
+            logger.info(f"[{i}/{len(image_paths)}] {image_path}")
+            if not run_creative(manifest, image_path, output_root):
+                failed += 1
+
+    summary = manifest.summary()
+    logger.info(f"Batch finished: {failed} creatives failed, stages {summary}")
+    if profile:
+        profiler.stop()
+        report = log_summary(profile_top_n)
+        with open(os.path.join(output_root, "profile_summary.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+    return summary
+
+
+def _collect_inputs(inputs: list[str]) -> list[str]:
+    image_paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for extension in ("png", "jpg", "jpeg"):
+                image_paths.extend(glob.glob(os.path.join(path, f"*.{extension}")))
+        else:
+            image_paths.append(path)
+    return sorted(image_paths)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clone a batch of creatives")
+    parser.add_argument("inputs", nargs="+", help="Image files or directories")
+    parser.add_argument("--output", default=CACHE_DIR)
+    parser.add_argument("--manifest", default=None)
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip completed stages and retry only failed or unfinished ones",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="Overlap stages of different creatives with per-stage worker pools",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=PROFILE_ENABLED,
+        help="Sample stacks per stage into <creative>/profile.collapsed",
+    )
+    parser.add_argument("--profile-top", type=int, default=10)
+    args = parser.parse_args()
+    run_batch(
+        _collect_inputs(args.inputs),
+        args.output,
+        args.manifest,
+        args.resume,
+        args.pipelined,
+        args.profile,
+        args.profile_top,
+    )
@@ -0,0 +1,125 @@
+from collections.abc import Iterable, Sequence
+
+import numpy as np
+from pydantic import BaseModel
+
+from schema import (
+    LineBox,
+    TextBlockWithFontSize,
+    TextBlockWithFontSizeAndLineSpacing,
+    TextBlockWithAlignment,
+    TextBlockWithFontName,
+    TextBlockWithFontNameAndColor,
+)
+
+ATTRIBUTE_COLUMNS = ("alignment", "font_name", "color")
+
+_BLOCK_MODELS = (
+    (TextBlockWithFontNameAndColor, {"alignment", "font_name", "color"}),
+    (TextBlockWithFontName, {"alignment", "font_name"}),
+    (TextBlockWithAlignment, {"alignment"}),
+)
+
+
+class BlockTable:
+    def __init__(
+        self,
+        texts: Sequence[str],
+        boxes: np.ndarray | Sequence[Sequence[int]],
+        font_sizes: np.ndarray | Sequence[int],
+        line_spacing: np.ndarray | Sequence[float] | None = None,
+        attributes: dict[str, list] | None = None,
+        ids: np.ndarray | Sequence[int] | None = None,
+        confidences: np.ndarray | Sequence[float] | None = None,
+        lines: Sequence[list[LineBox]] | None = None,
+    ):
+        self.texts = list(texts)
+        self.confidences = (
+            np.ones(len(self.texts))
+            if confidences is None
+            else np.asarray(confidences, dtype=float)
+        )
+        self.lines = [[] for _ in self.texts] if lines is None else list(lines)
+        self.ids = (
+            np.arange(len(self.texts)) if ids is None else np.asarray(ids, dtype=np.int64)
+        )
+        self.boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        self.font_sizes = np.asarray(font_sizes, dtype=np.int64)
+        self.line_spacing = (
+            None if line_spacing is None else np.asarray(line_spacing, dtype=float)
+        )
+        self.attributes = {name: list(values) for name, values in (attributes or {}).items()}
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @classmethod
+    def from_blocks(cls, blocks: Sequence[TextBlockWithFontSize]) -> "BlockTable":
+        line_spacing = None
+        if blocks and all(hasattr(block, "line_spacing") for block in blocks):
+            line_spacing = [block.line_spacing for block in blocks]
+        attributes = {
+            name: [getattr(block, name) for block in blocks]
+            for name in ATTRIBUTE_COLUMNS
+            if blocks and all(hasattr(block, name) for block in blocks)
+        }
+        return cls(
+            texts=[block.text for block in blocks],
+            boxes=[block.bounding_box for block in blocks],
+            font_sizes=[block.font_size for block in blocks],
+            line_spacing=line_spacing,
+            attributes=attributes,
+            confidences=[block.confidence for block in blocks],
+            lines=[list(block.lines) for block in blocks],
+        )
+
+    def take(self, indices: Iterable[int]) -> "BlockTable":
+        indices = np.fromiter(indices, dtype=np.int64)
+        return BlockTable(
+            texts=[self.texts[i] for i in indices],
+            boxes=self.boxes[indices],
+            font_sizes=self.font_sizes[indices],
+            line_spacing=None if self.line_spacing is None else self.line_spacing[indices],
+            attributes={
+                name: [values[i] for i in indices]
+                for name, values in self.attributes.items()
+            },
+            ids=self.ids[indices],
+            confidences=self.confidences[indices],
+            lines=[self.lines[i] for i in indices],
+        )
+
+    def set_attribute(self, name: str, values: Sequence):
+        if len(values) != len(self):
+            raise ValueError(f"{name} has {len(values)} values for {len(self)} blocks")
+        self.attributes[name] = list(values)
+
+    def _block_model(self) -> type[BaseModel]:
+        # The attribute models all extend the line-spacing model, so they
+        # are only usable once line spacing has been calculated.
+        if self.line_spacing is None:
+            return TextBlockWithFontSize
+        for model, columns in _BLOCK_MODELS:
+            if columns <= self.attributes.keys():
+                return model
+        return TextBlockWithFontSizeAndLineSpacing
+
+    def to_blocks(self) -> list[BaseModel]:
+        model = self._block_model()
+        fields = model.model_fields.keys()
+        blocks = []
+        for i, text in enumerate(self.texts):
+            data = {
+                "text": text,
+                "bounding_box": self.boxes[i].tolist(),
+                "font_size": int(self.font_sizes[i]),
+                "confidence": float(self.confidences[i]),
+                "lines": self.lines[i],
+            }
+            if "line_spacing" in fields:
+                data["line_spacing"] = float(self.line_spacing[i])
+            for name, values in self.attributes.items():
+                if name in fields:
+                    data[name] = values[i]
+            blocks.append(model(**data))
+        return blocks
@@ -0,0 +1,115 @@
+import os
+from functools import lru_cache
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+from loguru import logger
+
+from fonts import resolve_font_path
+from image_context import image_context
+from html_render import block_lines
+from layout_guides import apply_guides
+from schema import AnalyzedImage, TextBlockWithFontNameAndColor
+
+FALLBACK_FONT = os.getenv("FALLBACK_FONT", "DejaVuSans.ttf")
+DEFAULT_TEXT_COLOR = (255, 255, 255)
+
+
+@lru_cache(maxsize=256)
+def get_font(font_name: str, size: int) -> ImageFont.FreeTypeFont:
+    font_path = resolve_font_path(font_name) or FALLBACK_FONT
+    try:
+        return ImageFont.truetype(font_path, size)
+    except OSError:
+        logger.warning(f"Could not load {font_path}, using PIL default font")
+        return ImageFont.load_default(size)
+
+
+@lru_cache(maxsize=8192)
+def render_line(font_name: str, size: int, text: str) -> tuple[Image.Image, int, int, float]:
+    # Returns the line's coverage mask, its offset from the draw origin and
+    # its advance width. Cached so repeated lines are shaped once.
+    font = get_font(font_name, size)
+    left, top, right, bottom = font.getbbox(text)
+    mask = Image.new("L", (max(1, right - left), max(1, bottom - top)), 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+    return mask, left, top, font.getlength(text)
+
+
+def wrap_text(font_name: str, size: int, lines: list[str], max_width: float) -> list[str]:
+    # Keeps the given line breaks when every line fits, otherwise rewraps
+    # all words greedily to max_width.
+    font = get_font(font_name, size)
+    if all(font.getlength(line) <= max_width for line in lines):
+        return lines
+
+    wrapped = []
+    current = ""
+    for word in " ".join(lines).split():
+        candidate = f"{current} {word}" if current else word
+        if current and font.getlength(candidate) > max_width:
+            wrapped.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        wrapped.append(current)
+    return wrapped
+
+
+def _load_background(background_path: str, size: tuple[int, int]) -> Image.Image:
+    # Image contexts are keyed by path and mtime, so a regenerated.png
+    # rewritten in place is decoded again rather than served stale.
+    context = image_context(background_path)
+    if context.size == size:
+        return context.rgb
+    return context.memo(
+        ("resized", size), lambda: context.rgb.resize(size, Image.Resampling.LANCZOS)
+    )
+
+
+def _parse_color(color: str) -> tuple[int, int, int]:
+    try:
+        return ImageColor.getrgb(color)[:3]
+    except ValueError:
+        logger.warning(f"Invalid text color {color!r}, using white")
+        return DEFAULT_TEXT_COLOR
+
+
+def draw_block(canvas: Image.Image, block: TextBlockWithFontNameAndColor):
+    x1, y1, x3, _ = block.bounding_box
+    line_height = block.font_size + block.line_spacing
+    color = _parse_color(block.color)
+
+    for i, line in enumerate(block_lines(block)):
+        if not line:
+            continue
+        mask, left, top, advance = render_line(block.font_name, block.font_size, line)
+        if block.alignment == "center":
+            x = x1 + (x3 - x1 - advance) / 2
+        elif block.alignment == "right":
+            x = x3 - advance
+        else:
+            x = x1
+        # Same vertical placement as CSS line-height: glyphs centered in the line box.
+        y = y1 + i * line_height + (line_height - block.font_size) / 2
+        origin = (round(x + left), round(y + top))
+        canvas.paste(
+            color, (*origin, origin[0] + mask.width, origin[1] + mask.height), mask
+        )
+
+
+def composite_image(analyzed_image: AnalyzedImage, background_path: str) -> Image.Image:
+    size = (analyzed_image.width, analyzed_image.height)
+    canvas = _load_background(background_path, size).copy()
+    for block in apply_guides(analyzed_image.text_blocks, analyzed_image.guides):
+        draw_block(canvas, block)
+    return canvas
+
+
+def render_analyzed_image(
+    analyzed_image: AnalyzedImage,
+    background_path: str,
+    output_path: str,
+) -> str:
+    composite_image(analyzed_image, background_path).save(output_path)
+    return output_path
@@ -0,0 +1,54 @@
+import io
+import os
+import re
+from functools import lru_cache
+
+from fontTools import subset
+from fontTools.ttLib import TTFont
+from loguru import logger
+
+FONTS_DIR = os.getenv("FONTS_DIR", "fonts")
+FONT_EXTENSIONS = (".ttf", ".otf")
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+@lru_cache(maxsize=1)
+def _font_files() -> dict[str, list[str]]:
+    fonts = {}
+    for root, _, files in os.walk(FONTS_DIR):
+        for file_name in files:
+            if file_name.lower().endswith(FONT_EXTENSIONS):
+                family = file_name.rsplit(".", 1)[0].split("-")[0]
+                fonts.setdefault(_normalize(family), []).append(os.path.join(root, file_name))
+    return fonts
+
+
+@lru_cache(maxsize=256)
+def resolve_font_path(font_name: str) -> str | None:
+    candidates = _font_files().get(_normalize(font_name))
+    if not candidates:
+        logger.warning(f"No local font file for {font_name!r} in {FONTS_DIR}")
+        return None
+    for path in sorted(candidates):
+        stem = os.path.basename(path).rsplit(".", 1)[0]
+        style = stem.split("-", 1)[1] if "-" in stem else ""
+        if style.lower() in ("", "regular"):
+            return path
+    return sorted(candidates)[0]
+
+
+@lru_cache(maxsize=256)
+def subset_font_woff2(font_path: str, characters: frozenset[str]) -> bytes:
+    options = subset.Options()
+    options.flavor = "woff2"
+    font = TTFont(font_path)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(text="".join(sorted(characters)))
+    subsetter.subset(font)
+    font.flavor = "woff2"
+    buffer = io.BytesIO()
+    font.save(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,194 @@
+import os
+import queue
+import threading
+import time
+from collections.abc import Callable
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel
+
+from metrics import RETRIES, Counter, Gauge, register_collector
+from profiling import inherit_stage
+
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "0") == "1"
+# Overall deadline for a hedged call, covering both providers.
+HEDGE_TIMEOUT_S = float(os.getenv("HEDGE_TIMEOUT_S", "180"))
+
+
+class HedgePolicy(BaseModel):
+    primary: str
+    secondary: str
+    delay_s: float
+
+
+class HedgeStats(BaseModel):
+    requests: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    failures: int = 0
+    latency_saved_s: float = 0.0
+    slow_primary_latencies: list[float] = []
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedges / self.requests if self.requests else 0.0
+
+
+HEDGE_POLICIES = {
+    "text": HedgePolicy(primary="anthropic", secondary="openai", delay_s=8.0),
+    "alignment": HedgePolicy(primary="openai", secondary="anthropic", delay_s=6.0),
+    "font_name": HedgePolicy(primary="openai", secondary="anthropic", delay_s=6.0),
+    "color": HedgePolicy(primary="openai", secondary="anthropic", delay_s=6.0),
+}
+HEDGE_STATS: dict[str, HedgeStats] = {stage: HedgeStats() for stage in HEDGE_POLICIES}
+_SLOW_PRIMARY_WINDOW = 100
+_stats_lock = threading.Lock()
+
+# Hedges launched are counted as clone_retries_total{kind="hedge"}.
+HEDGED_CALLS = Counter(
+    "clone_hedged_calls_total",
+    "Hedged LLM calls by stage and winner (primary, secondary or none)",
+)
+HEDGE_LATENCY_SAVED = Counter(
+    "clone_hedge_latency_saved_seconds_total",
+    "Estimated latency saved by hedge wins, against the mean of recent primaries "
+    "that ran past the hedge delay; wins before one has been seen add nothing",
+)
+HEDGE_RATE = Gauge("clone_hedge_rate", "Share of hedged calls that launched the secondary")
+
+
+class HedgeCancelled(Exception):
+    pass
+
+
+def _record(stage: str, policy: HedgePolicy, winner: str, hedged: bool, elapsed: float):
+    with _stats_lock:
+        stats = HEDGE_STATS.setdefault(stage, HedgeStats())
+        stats.requests += 1
+        stats.hedges += int(hedged)
+        if hedged:
+            RETRIES.inc(kind="hedge", stage=stage)
+        if winner == policy.primary:
+            HEDGED_CALLS.inc(stage=stage, winner="primary")
+            if elapsed > policy.delay_s:
+                stats.slow_primary_latencies.append(elapsed)
+                del stats.slow_primary_latencies[:-_SLOW_PRIMARY_WINDOW]
+            return
+        stats.hedge_wins += 1
+        HEDGED_CALLS.inc(stage=stage, winner="secondary")
+        # The cancelled primary's latency is unknown; estimate it from
+        # recent primaries that also ran past the hedge delay. Until one has
+        # been seen there is nothing to estimate from and the win saves 0.
+        if stats.slow_primary_latencies:
+            expected = float(np.mean(stats.slow_primary_latencies))
+            saved = max(0.0, expected - elapsed)
+            stats.latency_saved_s += saved
+            HEDGE_LATENCY_SAVED.inc(saved, stage=stage)
+            logger.info(f"{stage}: {policy.secondary} won the hedge, ~{saved:.1f}s saved")
+        else:
+            logger.info(f"{stage}: {policy.secondary} won the hedge")
+
+
+def hedged_call(
+    stage: str,
+    policy: HedgePolicy,
+    call: Callable[[str, threading.Event], str],
+    validate: Callable[[str], bool],
+    timeout_s: float = HEDGE_TIMEOUT_S,
+) -> str:
+    started = time.perf_counter()
+    deadline = started + timeout_s
+    results: queue.Queue[tuple[str, str | None, Exception | None]] = queue.Queue()
+    cancel = {policy.primary: threading.Event(), policy.secondary: threading.Event()}
+
+    def run(provider: str):
+        try:
+            results.put((provider, call(provider, cancel[provider]), None))
+        except Exception as e:
+            results.put((provider, None, e))
+
+    def launch(provider: str):
+        threading.Thread(target=inherit_stage(run), args=(provider,), daemon=True).start()
+
+    launch(policy.primary)
+    hedged = False
+    running = 1
+    fallback_text = None
+    last_error = None
+
+    while running:
+        now = time.perf_counter()
+        if now >= deadline:
+            logger.warning(f"{stage}: no provider answered within {timeout_s:g}s")
+            for event in cancel.values():
+                event.set()
+            last_error = TimeoutError(f"{stage}: hedged call timed out after {timeout_s:g}s")
+            break
+        timeout = deadline - now
+        if not hedged:
+            timeout = min(timeout, max(0.0, started + policy.delay_s - now))
+        try:
+            provider, text, error = results.get(timeout=timeout)
+        except queue.Empty:
+            if hedged:
+                continue
+            logger.info(f"{stage}: {policy.primary} slow, hedging to {policy.secondary}")
+            hedged = True
+            running += 1
+            launch(policy.secondary)
+            continue
+        running -= 1
+
+        if error is None and validate(text):
+            for other, event in cancel.items():
+                if other != provider:
+                    event.set()
+            _record(stage, policy, provider, hedged, time.perf_counter() - started)
+            return text
+
+        if error is not None:
+            logger.warning(f"{stage}: {provider} failed: {error}")
+            last_error = error
+        else:
+            fallback_text = text
+        if not hedged:
+            hedged = True
+            running += 1
+            launch(policy.secondary)
+
+    with _stats_lock:
+        stats = HEDGE_STATS.setdefault(stage, HedgeStats())
+        stats.requests += 1
+        stats.hedges += int(hedged)
+        stats.failures += 1
+    if hedged:
+        RETRIES.inc(kind="hedge", stage=stage)
+    HEDGED_CALLS.inc(stage=stage, winner="none")
+    if fallback_text is not None:
+        return fallback_text
+    raise last_error
+
+
+def hedge_stats() -> dict[str, dict]:
+    with _stats_lock:
+        return {
+            stage: {
+                "requests": stats.requests,
+                "hedge_rate": stats.hedge_rate,
+                "hedge_wins": stats.hedge_wins,
+                "failures": stats.failures,
+                # An estimate, see HEDGE_LATENCY_SAVED.
+                "latency_saved_s": stats.latency_saved_s,
+            }
+            for stage, stats in HEDGE_STATS.items()
+        }
+
+
+def _collect_hedge_metrics():
+    for stage, stats in hedge_stats().items():
+        if stats["requests"]:
+            HEDGE_RATE.set(stats["hedge_rate"], stage=stage)
+
+
+register_collector(_collect_hedge_metrics)
@@ -8,9 +8,11 @@ client = anthropic.Anthropic(
     api_key=os.getenv("ANTHROPIC_API_KEY"),
 )
 
+from metrics import provider_timed
 from schema import TextBlockWithFontName
 
 
+@provider_timed("anthropic", "html")
 def generate_html(width: int, height: int, text_blocks: list[TextBlockWithFontName], image_path: str):
     prompt = f"""
     You need to generate a HTML code for a white page with black text.
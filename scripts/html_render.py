@@ -0,0 +1,88 @@
+import base64
+import html
+import mimetypes
+import os
+
+from schema import AnalyzedImage, TextBlockWithFontNameAndColor
+from fonts import resolve_font_path, subset_font_woff2
+from layout_guides import apply_guides
+
+
+def block_lines(block: TextBlockWithFontNameAndColor) -> list[str]:
+    return block.text.replace("\\n", "\n").split("\n")
+
+
+def _font_faces(text_blocks: list[TextBlockWithFontNameAndColor]) -> dict[str, str]:
+    characters: dict[str, set[str]] = {}
+    for block in text_blocks:
+        characters.setdefault(block.font_name, set()).update(
+            "".join(block_lines(block))
+        )
+
+    font_faces = {}
+    for font_name, used in characters.items():
+        font_path = resolve_font_path(font_name)
+        if font_path is None:
+            continue
+        font_data = subset_font_woff2(font_path, frozenset(used))
+        font_faces[font_name] = base64.b64encode(font_data).decode("utf-8")
+    return font_faces
+
+
+def _background_url(background_path: str, inline: bool) -> str:
+    # Not inlined, the background is expected next to the HTML file.
+    if not inline:
+        return html.escape(os.path.basename(background_path), quote=True)
+    media_type = mimetypes.guess_type(background_path)[0] or "image/png"
+    with open(background_path, "rb") as f:
+        encoded = base64.b64encode(f.read()).decode("utf-8")
+    return f"data:{media_type};base64,{encoded}"
+
+
+def render_static_html(
+    analyzed_image: AnalyzedImage,
+    background_path: str,
+    inline_background: bool = False,
+    background_url: str | None = None,
+) -> str:
+    # background_url overrides the background reference, e.g. to point
+    # several renders at one shared file.
+    font_faces = _font_faces(analyzed_image.text_blocks)
+    if background_url is None:
+        background_url = _background_url(background_path, inline_background)
+    else:
+        background_url = html.escape(background_url, quote=True)
+    css = [
+        "html,body{margin:0;padding:0}",
+        f".canvas{{position:relative;overflow:hidden;"
+        f"width:{analyzed_image.width}px;height:{analyzed_image.height}px;"
+        f"background:url('{background_url}')"
+        f" center/cover no-repeat}}",
+        ".block{position:absolute;margin:0;white-space:nowrap}",
+    ]
+    for i, (font_name, font_data) in enumerate(font_faces.items()):
+        css.append(
+            f"@font-face{{font-family:'f{i}';"
+            f"src:url(data:font/woff2;base64,{font_data}) format('woff2')}}"
+        )
+    families = {font_name: f"f{i}" for i, font_name in enumerate(font_faces)}
+
+    blocks_html = []
+    for block in apply_guides(analyzed_image.text_blocks, analyzed_image.guides):
+        x1, y1, x3, y3 = block.bounding_box
+        family = families.get(block.font_name)
+        font_family = f"'{family}'" if family else f"'{html.escape(block.font_name)}',sans-serif"
+        style = (
+            f"left:{x1}px;top:{y1}px;width:{x3 - x1}px;height:{y3 - y1}px;"
+            f"font-family:{font_family};font-size:{block.font_size}px;"
+            f"line-height:{block.font_size + block.line_spacing:g}px;"
+            f"text-align:{block.alignment};color:{html.escape(block.color)}"
+        )
+        text = "<br>".join(html.escape(line) for line in block_lines(block))
+        blocks_html.append(f'<p class="block" style="{style}">{text}</p>')
+
+    return (
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+        f"<style>{''.join(css)}</style></head>"
+        f"<body><div class=\"canvas\">{''.join(blocks_html)}</div></body></html>"
+    )
@@ -0,0 +1,188 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+
+import numpy as np
+from PIL import Image
+
+MAX_IMAGE_CONTEXTS = int(os.getenv("MAX_IMAGE_CONTEXTS", "32"))
+# Bytes of file data, decoded pixels and encodings the registry keeps alive
+# across contexts; least recently used contexts are dropped past it.
+MAX_IMAGE_CONTEXT_BYTES = int(os.getenv("MAX_IMAGE_CONTEXT_BYTES", str(512 * 1024 * 1024)))
+_MEDIA_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def _memo_bytes(value: Any) -> int:
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, tuple):
+        return sum(_memo_bytes(item) for item in value)
+    return 0
+
+
+class ImageContext:
+    # One image file's derived artifacts. Size and format come from the
+    # header; bytes, hash, decoded pixels and encodings are computed on first
+    # use and shared by every stage of the run. Returned objects are shared:
+    # callers must copy before mutating.
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._memo: dict[Any, Any] = {}
+
+    def __fspath__(self) -> str:
+        return self.path
+
+    def __str__(self) -> str:
+        return self.path
+
+    def _header(self) -> tuple[tuple[int, int], str | None]:
+        def read() -> tuple[tuple[int, int], str | None]:
+            with Image.open(self.path) as image:
+                return image.size, image.format
+
+        return self._memoize("header", read)
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self._header()[0]
+
+    @property
+    def format(self) -> str | None:
+        return self._header()[1]
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    @property
+    def media_type(self) -> str:
+        return _MEDIA_TYPES.get(self.format or "", "image/png")
+
+    def _memoize(self, key: Any, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key not in self._memo:
+                self._memo[key] = compute()
+            return self._memo[key]
+
+    def memo(self, key: Any, compute: Callable[[], Any]) -> Any:
+        # For values derived from the pixels. The bytes are loaded first, so
+        # a copied file has joined its source's memo before the lookup.
+        self.data
+        return self._memoize(key, compute)
+
+    def nbytes(self) -> int:
+        # Not under the lock: a memo can be held for a long computation, and
+        # eviction only needs an estimate.
+        return sum(_memo_bytes(value) for value in list(self._memo.values()))
+
+    @property
+    def data(self) -> bytes:
+        with self._lock:
+            if "data" in self._memo:
+                return self._memo["data"]
+        with open(self.path, "rb") as f:
+            data = f.read()
+        content_hash = hashlib.sha256(data).hexdigest()
+        _share_by_hash(self, content_hash)
+        with self._lock:
+            self._memo.setdefault("content_hash", content_hash)
+            return self._memo.setdefault("data", data)
+
+    @property
+    def content_hash(self) -> str:
+        # Computed together with the bytes.
+        self.data
+        return self._memo["content_hash"]
+
+    @property
+    def rgb(self) -> Image.Image:
+        def decode() -> Image.Image:
+            with Image.open(io.BytesIO(self.data)) as image:
+                return image.convert("RGB")
+
+        return self.memo("rgb", decode)
+
+    @property
+    def array(self) -> np.ndarray:
+        def to_array() -> np.ndarray:
+            array = np.asarray(self.rgb)
+            array.flags.writeable = False
+            return array
+
+        return self.memo("array", to_array)
+
+    @property
+    def gray(self) -> Image.Image:
+        return self.memo("gray", lambda: self.rgb.convert("L"))
+
+    @property
+    def base64(self) -> str:
+        return self.memo("base64", lambda: base64.b64encode(self.data).decode("utf-8"))
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.media_type};base64,{self.base64}"
+
+
+_contexts: OrderedDict[tuple, ImageContext] = OrderedDict()
+_by_hash: dict[str, ImageContext] = {}
+_contexts_lock = threading.Lock()
+
+
+def _share_by_hash(context: ImageContext, content_hash: str):
+    # Runs when a context first reads its bytes. A copied file (original.png
+    # next to the upload) then takes over the memo of its source, so the
+    # decode and encodings are shared. memo() loads the bytes before any
+    # lookup, so only the header is dropped from the copy's own memo.
+    with _contexts_lock:
+        source = _by_hash.setdefault(content_hash, context)
+    if source is not context:
+        with source._lock:
+            context._lock, context._memo = source._lock, source._memo
+
+
+def _evict():
+    # Called with _contexts_lock held. Contexts sharing a memo count once.
+    while len(_contexts) > 1:
+        memos = {}
+        for context in _contexts.values():
+            memos.setdefault(id(context._memo), context)
+        total = sum(context.nbytes() for context in memos.values())
+        if len(_contexts) <= MAX_IMAGE_CONTEXTS and total <= MAX_IMAGE_CONTEXT_BYTES:
+            return
+        _, evicted = _contexts.popitem(last=False)
+        for content_hash, context in list(_by_hash.items()):
+            if context is evicted:
+                del _by_hash[content_hash]
+
+
+def image_context(image: "str | ImageContext") -> ImageContext:
+    # Contexts are keyed by file identity, so a rewritten file gets a fresh
+    # one. The lookup itself only stats the file; nothing is read until a
+    # property needs it.
+    if isinstance(image, ImageContext):
+        return image
+    stat = os.stat(image)
+    key = (os.path.abspath(image), stat.st_mtime_ns, stat.st_size)
+    with _contexts_lock:
+        context = _contexts.get(key)
+        if context is None:
+            context = _contexts[key] = ImageContext(image)
+        _contexts.move_to_end(key)
+        _evict()
+        return context
@@ -1,14 +1,18 @@
 import os
 from loguru import logger
 import requests
-from PIL import Image
 import fal_client
 from openai import OpenAI
 from dotenv import load_dotenv
 from text_recognition import _encode_image_for_openai
+from image_context import image_context
+from metrics import provider_timed
+from profiling import StageThreadPoolExecutor
 
 load_dotenv()
 
+FLUX_MAX_IMAGES_PER_REQUEST = 4
+
 openai_client = OpenAI(
     api_key=os.getenv("OPENAI_API_KEY"),
 )
@@ -22,13 +26,14 @@ def on_queue_update(update):
     elif isinstance(update, fal_client.Completed):
         logger.info(update)
 
+@provider_timed("fal", "flux_pro_redux")
 def regenerate_image_flux_pro_redux(
     image_path: str,
     output_path: str,
     prompt: str,
 ):
     image_url = fal_client.upload_file(image_path)
-    width, height = Image.open(image_path).size
+    width, height = image_context(image_path).size
     logger.info(f"Regenerating image with size {width}x{height}")
     result = fal_client.subscribe(
         "fal-ai/flux-pro/v1.1/redux",
@@ -55,13 +60,31 @@ def regenerate_image_flux_pro_redux(
     return output_path
 
 
-def regenerate_image_flux_dev_redux(
+def _download_image(image_url: str, output_path: str) -> str:
+    image_data = requests.get(image_url).content
+    with open(output_path, "wb") as f:
+        f.write(image_data)
+    return output_path
+
+
+@provider_timed("fal", "flux_dev_redux")
+def regenerate_image_variants_flux_dev_redux(
     image_path: str,
-    output_path: str,
-):
-    image_url = fal_client.upload_file(image_path)
-    width, height = Image.open(image_path).size
-    logger.info(f"Regenerating image using Flux Dev Redux with size {width}x{height}")
+    output_paths: list[str],
+    image_url: str | None = None,
+) -> list[str]:
+    # One redux request for up to FLUX_MAX_IMAGES_PER_REQUEST outputs; the
+    # upload can be shared between calls by passing image_url.
+    if len(output_paths) > FLUX_MAX_IMAGES_PER_REQUEST:
+        raise ValueError(
+            f"At most {FLUX_MAX_IMAGES_PER_REQUEST} images per request, got {len(output_paths)}"
+        )
+    image_url = image_url or fal_client.upload_file(image_path)
+    width, height = image_context(image_path).size
+    logger.info(
+        f"Regenerating {len(output_paths)} images using Flux Dev Redux "
+        f"with size {width}x{height}"
+    )
     result = fal_client.subscribe(
         "fal-ai/flux/dev/redux",
         arguments={
@@ -71,7 +94,7 @@ def regenerate_image_flux_dev_redux(
             },
             "num_inference_steps": 28,
             "guidance_scale": 3.5,
-            "num_images": 1,
+            "num_images": len(output_paths),
             "safety_tolerance": "2",
             "output_format": "png",
             "image_url": image_url,
@@ -80,12 +103,56 @@ def regenerate_image_flux_dev_redux(
         on_queue_update=on_queue_update,
     )
     logger.info(result)
-    image_url = result["images"][0]["url"]
-    image_data = requests.get(image_url).content
-    with open(output_path, "wb") as f:
-        f.write(image_data)
-    return output_path
-    
+    images = result["images"]
+    if len(images) < len(output_paths):
+        raise RuntimeError(f"Redux returned {len(images)} of {len(output_paths)} images")
+    with StageThreadPoolExecutor(max_workers=len(output_paths)) as executor:
+        return list(
+            executor.map(
+                _download_image,
+                [image["url"] for image in images],
+                output_paths,
+            )
+        )
+
+
+def regenerate_image_flux_dev_redux(
+    image_path: str,
+    output_path: str,
+):
+    return regenerate_image_variants_flux_dev_redux(image_path, [output_path])[0]
+
+
+@provider_timed("fal", "flux_pro_fill")
+def outpaint_image_flux_pro_fill(
+    image_path: str,
+    mask_path: str,
+    output_path: str,
+    prompt: str = "",
+) -> str:
+    # White mask pixels are generated, black ones are kept from image_path.
+    image_url = fal_client.upload_file(image_path)
+    mask_url = fal_client.upload_file(mask_path)
+    width, height = image_context(image_path).size
+    logger.info(f"Outpainting image using Flux Pro Fill with size {width}x{height}")
+    result = fal_client.subscribe(
+        "fal-ai/flux-pro/v1/fill",
+        arguments={
+            "image_url": image_url,
+            "mask_url": mask_url,
+            "prompt": prompt,
+            "num_images": 1,
+            "safety_tolerance": "2",
+            "output_format": "png",
+        },
+        with_logs=True,
+        on_queue_update=on_queue_update,
+    )
+    logger.info(result)
+    return _download_image(result["images"][0]["url"], output_path)
+
+
+@provider_timed("openai", "prompt")
 def generate_prompt(image_path: str) -> str:
     prompt = """
     You need to generate a prompt for image generation.
@@ -3,36 +3,149 @@ import time
 from dotenv import load_dotenv
 import fal_client
 import requests
-from PIL import Image, ImageDraw
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
 
 from loguru import logger
 
+from image_context import image_context
+from metrics import provider_timed
 from schema import TextBlockWithFontSize
-from text_recognition import detect_text
 
 load_dotenv()
 os.environ["FAL_KEY"] = os.getenv("FAL_API_KEY")
 
 
+MASK_MODE = os.getenv("MASK_MODE", "glyph")
+MASK_DILATION = int(os.getenv("MASK_DILATION", "3"))
+MASK_FEATHER = float(os.getenv("MASK_FEATHER", "2"))
+MASK_BOX_PADDING = 4
+LINE_BOX_TOLERANCE = 2
+MASK_MIN_THRESHOLD = 24
+# Outside this range of glyph coverage inside a box the segmentation is not
+# trusted (busy or low-contrast background) and the whole box is masked.
+MASK_MIN_GLYPH_FRACTION = 0.005
+MASK_MAX_GLYPH_FRACTION = 0.6
+
+
+def _otsu_threshold(values: np.ndarray) -> int:
+    histogram = np.bincount(values.ravel(), minlength=256).astype(np.float64)
+    weights = np.cumsum(histogram)
+    means = np.cumsum(histogram * np.arange(256))
+    total, total_mean = weights[-1], means[-1]
+    background_weights = weights[:-1]
+    foreground_weights = total - background_weights
+    valid = (background_weights > 0) & (foreground_weights > 0)
+    between = np.zeros(255)
+    between[valid] = (
+        total_mean * background_weights[valid] - total * means[:-1][valid]
+    ) ** 2 / (background_weights[valid] * foreground_weights[valid])
+    return int(np.argmax(between))
+
+
+def _glyph_mask(region: np.ndarray) -> np.ndarray:
+    # Glyph pixels are the ones far from the box's background color, which
+    # is estimated as the median of the box border.
+    border = np.concatenate(
+        [region[0], region[-1], region[1:-1, 0], region[1:-1, -1]]
+    )
+    background = np.median(border, axis=0)
+    distance = np.abs(region.astype(np.int16) - background).max(axis=2).astype(np.uint8)
+    threshold = max(_otsu_threshold(distance), MASK_MIN_THRESHOLD)
+    glyphs = distance > threshold
+    if not MASK_MIN_GLYPH_FRACTION <= glyphs.mean() <= MASK_MAX_GLYPH_FRACTION:
+        return np.ones(region.shape[:2], dtype=bool)
+    return glyphs
+
+
+def _dilate(mask: np.ndarray, radius: int) -> np.ndarray:
+    # Square dilation as two separable running maxima.
+    rows = mask.copy()
+    for shift in range(1, radius + 1):
+        rows[shift:] |= mask[:-shift]
+        rows[:-shift] |= mask[shift:]
+    dilated = rows.copy()
+    for shift in range(1, radius + 1):
+        dilated[:, shift:] |= rows[:, :-shift]
+        dilated[:, :-shift] |= rows[:, shift:]
+    return dilated
+
+
+def _line_boxes(block: TextBlockWithFontSize) -> list[list[int]] | None:
+    # A block's box is the union of its line boxes. Line boxes that stick
+    # out of it come from another coordinate space (a stale cache, or an
+    # analysis reused at a different size) and are not trusted.
+    bx1, by1, bx3, by3 = block.bounding_box
+    boxes = []
+    for line in block.lines:
+        x1, y1, x3, y3 = line.bounding_box
+        if (
+            x1 < bx1 - LINE_BOX_TOLERANCE
+            or y1 < by1 - LINE_BOX_TOLERANCE
+            or x3 > bx3 + LINE_BOX_TOLERANCE
+            or y3 > by3 + LINE_BOX_TOLERANCE
+        ):
+            return None
+        boxes.append([max(x1, bx1), max(y1, by1), min(x3, bx3), min(y3, by3)])
+    return boxes or None
+
+
+def _mask_boxes(text_blocks: list[TextBlockWithFontSize]) -> list[list[int]]:
+    # OCR line boxes are tighter than merged multi-line block boxes.
+    boxes = []
+    for block in text_blocks:
+        line_boxes = _line_boxes(block)
+        if line_boxes is None:
+            boxes.append(block.bounding_box)
+        else:
+            boxes.extend(line_boxes)
+    return boxes
+
+
 def create_image_mask(
     image_path: str,
     text_blocks: list[TextBlockWithFontSize],
     output_path: str,
 ) -> str:
-    image = Image.open(image_path)
-    text_blocks = detect_text(image)
-    width, height = image.size
-    mask = Image.new("RGB", (width, height), color="black")
-    draw = ImageDraw.Draw(mask)
-
-    for block in text_blocks:
-        x1, y1, x3, y3 = block.bounding_box
-        draw.rectangle([(x1, y1), (x3, y3)], fill="white")
+    context = image_context(image_path)
+    boxes = _mask_boxes(text_blocks)
+    mask_image, mask_fraction, box_fraction = context.memo(
+        ("text_mask", tuple(map(tuple, boxes)), MASK_MODE, MASK_DILATION, MASK_FEATHER),
+        lambda: _build_mask(context.array, boxes),
+    )
+    mask_image.save(output_path)
 
-    mask.save(output_path)
+    logger.info(
+        f"Text mask covers {mask_fraction:.2%} of the image "
+        f"({box_fraction:.2%} with whole boxes)"
+    )
     return output_path
 
 
+def _build_mask(image: np.ndarray, boxes: list[list[int]]) -> tuple[Image.Image, float, float]:
+    height, width = image.shape[:2]
+    mask = np.zeros((height, width), dtype=bool)
+    box_area = np.zeros((height, width), dtype=bool)
+
+    for x1, y1, x3, y3 in boxes:
+        x1, y1 = max(x1 - MASK_BOX_PADDING, 0), max(y1 - MASK_BOX_PADDING, 0)
+        x3, y3 = min(x3 + MASK_BOX_PADDING, width), min(y3 + MASK_BOX_PADDING, height)
+        if x3 - x1 < 3 or y3 - y1 < 3:
+            continue
+        box_area[y1:y3, x1:x3] = True
+        if MASK_MODE == "glyph":
+            mask[y1:y3, x1:x3] |= _glyph_mask(image[y1:y3, x1:x3])
+        else:
+            mask[y1:y3, x1:x3] = True
+
+    if MASK_DILATION > 0:
+        mask = _dilate(mask, MASK_DILATION)
+    mask_image = Image.fromarray(mask.astype(np.uint8) * 255, mode="L")
+    if MASK_FEATHER > 0:
+        mask_image = mask_image.filter(ImageFilter.GaussianBlur(MASK_FEATHER))
+    return mask_image, float(mask.mean()), float(box_area.mean())
+
+
 def on_queue_update(update):
     if isinstance(update, fal_client.InProgress):
         for log in update.logs:
@@ -43,6 +156,7 @@ def on_queue_update(update):
         logger.info(update)
 
 
+@provider_timed("fal", "bria_eraser")
 def remove_text_from_image(
     image_path: str,
     mask_path: str,
@@ -0,0 +1,84 @@
+import hashlib
+import json
+
+from PIL import Image
+from loguru import logger
+
+from block_table import BlockTable
+from image_context import image_context
+from layout_guides import find_guides
+from schema import AnalyzedImage, TextBlockWithFontSize
+
+
+def block_fingerprint(image: Image.Image, block: TextBlockWithFontSize) -> str:
+    x1, y1, x3, y3 = block.bounding_box
+    crop = image.crop((x1, y1, x3, y3)).convert("RGB")
+    digest = hashlib.sha1()
+    digest.update(
+        json.dumps([block.text, block.bounding_box, block.font_size]).encode("utf-8")
+    )
+    digest.update(crop.tobytes())
+    return digest.hexdigest()
+
+
+def fingerprint_blocks(
+    image_path: str,
+    text_blocks: list[TextBlockWithFontSize],
+) -> list[str]:
+    image = image_context(image_path).rgb
+    return [block_fingerprint(image, block) for block in text_blocks]
+
+
+def find_dirty_blocks(image_path: str, analyzed_image: AnalyzedImage) -> list[int]:
+    stored = analyzed_image.block_fingerprints
+    if not stored:
+        return []
+    current = fingerprint_blocks(image_path, analyzed_image.text_blocks)
+    return [
+        i
+        for i, fingerprint in enumerate(current)
+        if i >= len(stored) or fingerprint != stored[i]
+    ]
+
+
+def reanalyze_blocks(
+    image_path: str,
+    analyzed_image: AnalyzedImage,
+    dirty_ids: list[int] | None = None,
+) -> AnalyzedImage:
+    from text_recognition import (
+        correct_text_with_llm,
+        identify_text_alignment,
+        identify_text_font_name,
+        identify_text_color,
+    )
+
+    dirty = sorted(set(dirty_ids or []) | set(find_dirty_blocks(image_path, analyzed_image)))
+    if not dirty:
+        logger.info("No dirty text blocks, reusing analysis")
+        return analyzed_image
+    logger.info(f"Re-analyzing text blocks {dirty}")
+
+    text_blocks = list(analyzed_image.text_blocks)
+    table = BlockTable.from_blocks(text_blocks).take(dirty)
+    table = correct_text_with_llm(image_path, table, crops=True)
+    table = identify_text_alignment(image_path, table, crops=True)
+    table = identify_text_font_name(image_path, table, crops=True)
+    table = identify_text_color(image_path, table, crops=True)
+
+    for block_id, block in zip(table.ids.tolist(), table.to_blocks()):
+        text_blocks[block_id] = block
+    missing = set(dirty) - set(table.ids.tolist())
+    if missing:
+        logger.warning(f"Keeping previous results for blocks {sorted(missing)}")
+
+    # Re-analyzed blocks can change text or alignment, so the guides are
+    # rebuilt from the updated blocks rather than carried over.
+    guides = find_guides(BlockTable.from_blocks(text_blocks))
+    return AnalyzedImage(
+        width=analyzed_image.width,
+        height=analyzed_image.height,
+        text_blocks=text_blocks,
+        block_fingerprints=fingerprint_blocks(image_path, text_blocks),
+        guides=guides,
+    )
@@ -0,0 +1,55 @@
+import json
+from collections.abc import Iterable, Iterator
+
+
+class JSONArrayParser:
+    # Yields each top-level object of a JSON array as soon as its closing
+    # brace arrives. Text before the opening bracket (e.g. ```json) is skipped,
+    # and malformed objects are dropped so their ids can be re-requested.
+
+    def __init__(self):
+        self._buffer = []
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> list[dict]:
+        items = []
+        for char in chunk:
+            if not self._started:
+                self._started = char == "["
+                continue
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    self._buffer = [char]
+                continue
+
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        items.append(json.loads("".join(self._buffer)))
+                    except json.JSONDecodeError:
+                        pass
+                    self._buffer = []
+        return items
+
+
+def iter_json_array(chunks: Iterable[str]) -> Iterator[dict]:
+    parser = JSONArrayParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+
+from block_table import BlockTable
+from schema import LayoutGuide, TextBlockWithFontNameAndColor
+
+GUIDE_TOLERANCE = int(os.getenv("GUIDE_TOLERANCE", "10"))
+
+
+def cluster_1d(values: np.ndarray, tolerance: int) -> tuple[np.ndarray, np.ndarray]:
+    # Sorts once and starts a new cluster at every gap wider than tolerance.
+    # Returns each value's cluster label and every cluster's median.
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    order = np.argsort(values, kind="stable")
+    sorted_values = values[order]
+    cluster_ids = np.concatenate(([0], np.cumsum(np.diff(sorted_values) > tolerance)))
+    labels = np.empty(len(values), dtype=np.int64)
+    labels[order] = cluster_ids
+
+    starts = np.flatnonzero(np.concatenate(([True], np.diff(cluster_ids) > 0)))
+    ends = np.append(starts[1:], len(values))
+    medians = (sorted_values[(starts + ends - 1) // 2] + sorted_values[(starts + ends) // 2]) / 2
+    return labels, medians
+
+
+def _guides_for(
+    values: np.ndarray, rows: np.ndarray, kind: str, tolerance: int
+) -> list[LayoutGuide]:
+    # Returns the guides shared by at least two rows.
+    labels, medians = cluster_1d(values, tolerance)
+    positions = np.round(medians).astype(np.int64)
+    # Long chains can span more than tolerance; their ends are left alone.
+    snapped = np.abs(positions[labels] - values) <= tolerance
+    counts = np.bincount(labels[snapped], minlength=len(positions))
+    shared = snapped & (counts[labels] > 1)
+    return [
+        LayoutGuide(
+            kind=kind,
+            position=int(positions[label]),
+            block_ids=rows[shared & (labels == label)].tolist(),
+        )
+        for label in np.flatnonzero(counts > 1)
+    ]
+
+
+def find_guides(table: BlockTable, tolerance: int = GUIDE_TOLERANCE) -> list[LayoutGuide]:
+    # Horizontal guides follow each block's alignment (left edges, centers or
+    # right edges), vertical guides are shared box bottoms. The analysis keeps
+    # the OCR boxes, which the text mask is built from; guides are applied
+    # when rendering.
+    boxes = table.boxes
+    alignments = np.array(table.attributes.get("alignment", ["left"] * len(table)))
+    x_values = {
+        "left": boxes[:, 0],
+        "center": (boxes[:, 0] + boxes[:, 2]) // 2,
+        "right": boxes[:, 2],
+    }
+
+    guides = []
+    for kind, values in x_values.items():
+        rows = np.flatnonzero(alignments == kind)
+        guides.extend(_guides_for(values[rows], rows, kind, tolerance))
+    guides.extend(_guides_for(boxes[:, 3], np.arange(len(table)), "baseline", tolerance))
+    return guides
+
+
+def apply_guides(
+    blocks: list[TextBlockWithFontNameAndColor], guides: list[LayoutGuide]
+) -> list[TextBlockWithFontNameAndColor]:
+    # Moves the blocks sharing a guide onto a common edge, center or bottom
+    # without changing their size. Works on scaled layouts too, since the
+    # common position comes from the blocks rather than the guide.
+    boxes = np.array([block.bounding_box for block in blocks], dtype=np.int64).reshape(-1, 4)
+    for guide in guides:
+        members = np.array([i for i in guide.block_ids if i < len(blocks)], dtype=np.int64)
+        if len(members) < 2:
+            continue
+        if guide.kind == "left":
+            shifts = boxes[members, 0].min() - boxes[members, 0]
+        elif guide.kind == "right":
+            shifts = boxes[members, 2].max() - boxes[members, 2]
+        elif guide.kind == "center":
+            centers = (boxes[members, 0] + boxes[members, 2]) // 2
+            shifts = round(centers.mean()) - centers
+        else:
+            shifts = round(boxes[members, 3].mean()) - boxes[members, 3]
+        columns = [1, 3] if guide.kind == "baseline" else [0, 2]
+        boxes[np.ix_(members, columns)] += shifts[:, None]
+    return [
+        block.model_copy(update={"bounding_box": box.tolist()})
+        for block, box in zip(blocks, boxes)
+    ]
@@ -0,0 +1,278 @@
+import json
+import math
+import os
+import time
+
+from loguru import logger
+from pydantic import BaseModel
+
+from compositor import get_font, render_analyzed_image, wrap_text
+from html_render import block_lines, render_static_html
+from json_stream import iter_json_array
+from metrics import RETRIES
+from profiling import StageThreadPoolExecutor
+from schema import AnalyzedImage, TextBlockWithFontNameAndColor
+from text_recognition import _ask_claude
+
+LOCALES = [locale for locale in os.getenv("LOCALES", "").split(",") if locale]
+# Locales per translation request; bounds the size of one structured response.
+LOCALES_PER_REQUEST = int(os.getenv("LOCALES_PER_REQUEST", "8"))
+LOCALIZE_MAX_TOKENS = 8192
+TRANSLATE_MAX_ATTEMPTS = 3
+MIN_FIT_SCALE = 0.7
+FIT_HEIGHT_TOLERANCE = 1.15
+WRAPPED_LINE_SPACING = 0.2
+RENDER_WORKERS = int(os.getenv("LOCALIZE_RENDER_WORKERS", "4"))
+
+
+class LocaleReport(BaseModel):
+    locale: str
+    blocks: int
+    shrunk: int
+    overflowing: int
+    render_seconds: float
+
+
+def _translation_prompt(
+    text_blocks: list[TextBlockWithFontNameAndColor],
+    locales: list[str],
+    requested: dict[str, set[int]] | None = None,
+    shorter: bool = False,
+) -> str:
+    prompt = """
+    You will be given the text blocks of an advertising creative and a list of
+    target locales. Translate every block into every locale.
+    Each block has a character budget: the translation is rendered into the
+    same box, so stay within the budget, shortening the wording if needed.
+    Keep line breaks (\\n) where a natural break exists.
+    Only return the information in this JSON format:
+    [
+        {"locale": "<locale>", "id": <block id>, "text": "translated text"},
+        ...
+    ]
+    Do not write any other text, don't write ```json or ```
+    """
+    if shorter:
+        prompt += (
+            "These translations did not fit their boxes. Return shorter ones "
+            "only for the listed locales and ids.\n"
+        )
+    elif requested:
+        prompt += "Return translations only for the listed locales and ids.\n"
+    blocks = [
+        {
+            "id": i,
+            "text": "\n".join(block_lines(block)),
+            "budget": len(" ".join(block_lines(block))),
+        }
+        for i, block in enumerate(text_blocks)
+    ]
+    prompt += f"Blocks: {json.dumps(blocks, ensure_ascii=False)}\n"
+    if requested:
+        prompt += f"Requested: {json.dumps({k: sorted(v) for k, v in requested.items()})}\n"
+    else:
+        prompt += f"Locales: {json.dumps(locales)}\n"
+    return prompt
+
+
+def translate_blocks(
+    text_blocks: list[TextBlockWithFontNameAndColor],
+    locales: list[str],
+    requested: dict[str, set[int]] | None = None,
+    shorter: bool = False,
+) -> dict[str, dict[int, str]]:
+    # One structured request covers LOCALES_PER_REQUEST locales; groups are
+    # sent concurrently. Ids missing from a reply are re-requested, and ids
+    # still missing after TRANSLATE_MAX_ATTEMPTS are left out of the result.
+    pending = {
+        locale: set(requested[locale]) if requested else set(range(len(text_blocks)))
+        for locale in locales
+        if not requested or locale in requested
+    }
+    pending = {locale: ids for locale, ids in pending.items() if ids}
+    translations: dict[str, dict[int, str]] = {}
+
+    def request(group: list[str], partial: bool) -> list[dict]:
+        response_text = _ask_claude(
+            _translation_prompt(
+                text_blocks,
+                group,
+                {locale: pending[locale] for locale in group} if partial else None,
+                shorter,
+            ),
+            [],
+            max_tokens=LOCALIZE_MAX_TOKENS,
+        )
+        logger.info(f"translation response for {group}: {response_text}")
+        return list(iter_json_array([response_text]))
+
+    for attempt in range(TRANSLATE_MAX_ATTEMPTS):
+        if not pending:
+            break
+        if attempt:
+            logger.warning(f"translations missing for {pending}, re-requesting")
+            RETRIES.inc(kind="missing_translations", stage="localize")
+        locale_order = list(pending)
+        groups = [
+            locale_order[start : start + LOCALES_PER_REQUEST]
+            for start in range(0, len(locale_order), LOCALES_PER_REQUEST)
+        ]
+        partial = bool(requested) or attempt > 0
+        with StageThreadPoolExecutor(max_workers=len(groups)) as executor:
+            responses = list(executor.map(lambda group: request(group, partial), groups))
+        for items in responses:
+            for item in items:
+                try:
+                    locale, block_id, text = item["locale"], int(item["id"]), item["text"]
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if isinstance(text, str) and block_id in pending.get(locale, ()):
+                    translations.setdefault(locale, {})[block_id] = text
+                    pending[locale].discard(block_id)
+        pending = {locale: ids for locale, ids in pending.items() if ids}
+
+    if pending:
+        logger.error(
+            f"no translations for {pending} after {TRANSLATE_MAX_ATTEMPTS} attempts"
+        )
+    return translations
+
+
+def fit_text(
+    block: TextBlockWithFontNameAndColor, text: str
+) -> tuple[TextBlockWithFontNameAndColor, bool]:
+    # Rewraps text into the block's width and shrinks the font down to
+    # MIN_FIT_SCALE until it also fits the box height.
+    x1, y1, x3, y3 = block.bounding_box
+    box_width = x3 - x1
+    max_height = (y3 - y1) * FIT_HEIGHT_TOLERANCE
+    lines = text.replace("\\n", "\n").split("\n")
+
+    steps = math.ceil((1 - MIN_FIT_SCALE) / 0.05)
+    for step in range(steps + 1):
+        font_size = max(1, round(block.font_size * (1 - 0.05 * step)))
+        wrapped = wrap_text(block.font_name, font_size, lines, box_width)
+        line_spacing = 0.0
+        if len(wrapped) > 1:
+            line_spacing = max(
+                block.line_spacing * font_size / block.font_size,
+                font_size * WRAPPED_LINE_SPACING,
+            )
+        font = get_font(block.font_name, font_size)
+        width = max(font.getlength(line) for line in wrapped)
+        height = len(wrapped) * (font_size + line_spacing) - line_spacing
+        fits = width <= box_width and height <= max_height
+        if fits or step == steps:
+            break
+
+    localized = block.model_copy(
+        update={
+            "text": "\\n".join(wrapped),
+            "font_size": font_size,
+            "line_spacing": line_spacing,
+            "lines": [],
+        }
+    )
+    return localized, fits
+
+
+def _localize(
+    analyzed_image: AnalyzedImage, translations: dict[int, str]
+) -> tuple[AnalyzedImage, list[bool], set[int]]:
+    blocks, shrunk, overflowing = [], [], set()
+    for i, block in enumerate(analyzed_image.text_blocks):
+        localized, fits = fit_text(block, translations[i])
+        blocks.append(localized)
+        shrunk.append(localized.font_size < block.font_size)
+        if not fits:
+            overflowing.add(i)
+    localized_image = analyzed_image.model_copy(
+        update={"text_blocks": blocks, "block_fingerprints": []}
+    )
+    return localized_image, shrunk, overflowing
+
+
+def _render_locale(
+    locale_image: AnalyzedImage,
+    background_path: str,
+    locale_dir: str,
+) -> float:
+    started = time.perf_counter()
+    os.makedirs(locale_dir, exist_ok=True)
+    with open(os.path.join(locale_dir, "analyzed_image.json"), "w", encoding="utf-8") as f:
+        json.dump(locale_image.model_dump(), f, indent=4, ensure_ascii=False)
+    # The HTML points at the shared background instead of copying it.
+    background_url = os.path.relpath(background_path, locale_dir).replace(os.sep, "/")
+    with open(os.path.join(locale_dir, "index.html"), "w", encoding="utf-8") as f:
+        f.write(render_static_html(locale_image, background_path, background_url=background_url))
+    render_analyzed_image(
+        locale_image, background_path, os.path.join(locale_dir, "composited.png")
+    )
+    return time.perf_counter() - started
+
+
+def localize(
+    analyzed_image: AnalyzedImage,
+    background_path: str,
+    output_dir: str,
+    locales: list[str] = LOCALES,
+) -> list[LocaleReport]:
+    translations = translate_blocks(analyzed_image.text_blocks, locales)
+    # A locale with any untranslated block is skipped rather than rendered
+    # with English text mixed in.
+    complete = [
+        locale
+        for locale in locales
+        if len(translations.get(locale, {})) == len(analyzed_image.text_blocks)
+    ]
+    incomplete = [locale for locale in locales if locale not in complete]
+    if incomplete:
+        logger.error(f"Skipping locales with untranslated blocks: {incomplete}")
+
+    localized = {locale: _localize(analyzed_image, translations[locale]) for locale in complete}
+    # One follow-up request for every block that still overflows at the
+    # smallest font, across all locales.
+    retry = {locale: result[2] for locale, result in localized.items() if result[2]}
+    if retry:
+        logger.info(f"Retrying overflowing translations: {retry}")
+        shorter = translate_blocks(analyzed_image.text_blocks, list(retry), retry, shorter=True)
+        for locale, texts in shorter.items():
+            merged = {**translations[locale], **{i: texts[i] for i in retry[locale] if i in texts}}
+            localized[locale] = _localize(analyzed_image, merged)
+
+    locales_dir = os.path.join(output_dir, "locales")
+    with StageThreadPoolExecutor(max_workers=RENDER_WORKERS) as executor:
+        render_seconds = dict(
+            zip(
+                localized,
+                executor.map(
+                    lambda locale: _render_locale(
+                        localized[locale][0],
+                        background_path,
+                        os.path.join(locales_dir, locale),
+                    ),
+                    localized,
+                ),
+            )
+        )
+
+    reports = [
+        LocaleReport(
+            locale=locale,
+            blocks=len(analyzed_image.text_blocks),
+            shrunk=sum(shrunk),
+            overflowing=len(overflowing),
+            render_seconds=render_seconds[locale],
+        )
+        for locale, (_, shrunk, overflowing) in localized.items()
+    ]
+    for report in reports:
+        if report.overflowing:
+            logger.warning(
+                f"{report.locale}: {report.overflowing} blocks still overflow their boxes"
+            )
+    logger.info(
+        f"Localized into {len(reports)} locales, "
+        f"{sum(r.render_seconds for r in reports) / max(len(reports), 1):.3f}s render per locale"
+    )
+    return reports
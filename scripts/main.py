@@ -2,6 +2,10 @@ import json
 import os
 import shutil
 from html_generation import generate_html
+from html_render import render_static_html
+from compositor import render_analyzed_image
+from relayout import relayout
+from localization import LOCALES, localize
 from image_processing import (
     debug_draw_bounding_boxes,
     remove_text_from_image,
@@ -13,35 +17,109 @@ from image_generation import (
     generate_prompt,
 )
 from text_recognition import analyze_image
+from image_context import image_context
+from incremental import reanalyze_blocks
+from phash_index import PHASH_INDEX_PATH, PerceptualHashIndex, reuse_analysis
+from metrics import CACHE_LOOKUPS, stage_timed
+from profiling import PROFILE_ENABLED, log_summary, profiled_stage, profiler
+from schema import AnalyzedImage
 
 
 CACHE_DIR = "cache"
+HTML_MODE = os.getenv("HTML_MODE", "llm")
+COMPOSITE_ENABLED = os.getenv("COMPOSITE_ENABLED", "0") == "1"
+RELAYOUT_ENABLED = os.getenv("RELAYOUT_ENABLED", "0") == "1"
 
 
-def clone_image(image_path: str, output_dir: str):
-    # shutil.copy(image_path, os.path.join(output_dir, "original.png"))
-    # if not os.path.exists(output_dir):
-    #     os.makedirs(output_dir)
-    # analyzed_image = analyze_image(image_path)
-    # with open(
-    #     os.path.join(output_dir, "analyzed_image.json"), "w", encoding="utf-8"
-    # ) as f:
-    #     json.dump(analyzed_image.model_dump(), f, indent=4)
+def pipeline_stage(name: str):
+    def decorator(fn):
+        return stage_timed(name)(profiled_stage(name)(fn))
+
+    return decorator
+
+
+def _atomic_write(path: str, content: str):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def _save_analysis(analyzed_image: AnalyzedImage, analysis_path: str):
+    _atomic_write(analysis_path, json.dumps(analyzed_image.model_dump(), indent=4))
+
+
+def _load_analysis(output_dir: str) -> AnalyzedImage:
     with open(
         os.path.join(output_dir, "analyzed_image.json"), "r", encoding="utf-8"
     ) as f:
-        from schema import AnalyzedImage
-        analyzed_image = AnalyzedImage(**json.load(f))
+        return AnalyzedImage(**json.load(f))
+
+
+def load_or_analyze_image(
+    image_path: str, output_dir: str, phash_index_path: str = PHASH_INDEX_PATH
+) -> AnalyzedImage:
+    analysis_path = os.path.join(output_dir, "analyzed_image.json")
+    if os.path.exists(analysis_path):
+        CACHE_LOOKUPS.inc(cache="analysis", result="hit")
+        with open(analysis_path, "r", encoding="utf-8") as f:
+            analyzed_image = AnalyzedImage(**json.load(f))
+        reanalyzed_image = reanalyze_blocks(image_path, analyzed_image)
+        if reanalyzed_image is not analyzed_image:
+            _save_analysis(reanalyzed_image, analysis_path)
+        return reanalyzed_image
 
+    extension = os.path.splitext(image_path)[1] or ".png"
+    original_path = os.path.join(output_dir, f"original{extension}")
+    shutil.copy(image_path, original_path)
+    context = image_context(original_path)
+    phash_index = PerceptualHashIndex(phash_index_path)
+    match = phash_index.find(context)
+    CACHE_LOOKUPS.inc(cache="analysis", result="miss")
+    CACHE_LOOKUPS.inc(cache="phash", result="miss" if match is None else "hit")
+    if match is not None:
+        analyzed_image = reuse_analysis(original_path, match)
+    else:
+        analyzed_image = analyze_image(context)
+    _save_analysis(analyzed_image, analysis_path)
+    phash_index.add(original_path, analysis_path)
+    return analyzed_image
+
+
+@pipeline_stage("analyze")
+def stage_analyze(image_path: str, output_dir: str) -> str:
+    load_or_analyze_image(image_path, output_dir)
+    return os.path.join(output_dir, "analyzed_image.json")
+
+
+@pipeline_stage("mask")
+def stage_mask(image_path: str, output_dir: str) -> str:
+    analyzed_image = _load_analysis(output_dir)
     text_mask_path = os.path.join(output_dir, "text_mask.png")
     create_image_mask(
         image_path=image_path,
         text_blocks=analyzed_image.text_blocks,
         output_path=text_mask_path,
     )
+    return text_mask_path
+
+
+@pipeline_stage("erase")
+def stage_erase(image_path: str, output_dir: str) -> str:
+    text_mask_path = os.path.join(output_dir, "text_mask.png")
     cleaned_image_path = os.path.join(output_dir, "cleaned.png")
-    # remove_text_from_image(image_path, text_mask_path, cleaned_image_path)
+    # The eraser is the slowest paid call; keep its output unless the mask
+    # was rebuilt after it.
+    if not os.path.exists(cleaned_image_path) or os.path.getmtime(
+        cleaned_image_path
+    ) < os.path.getmtime(text_mask_path):
+        remove_text_from_image(image_path, text_mask_path, cleaned_image_path)
+    return cleaned_image_path
 
+
+@pipeline_stage("regenerate")
+def stage_regenerate(image_path: str, output_dir: str) -> str:
+    cleaned_image_path = os.path.join(output_dir, "cleaned.png")
     regenerated_image_path = os.path.join(output_dir, "regenerated.png")
     regenerate_image_flux_dev_redux(cleaned_image_path, regenerated_image_path)
     # prompt = generate_prompt(cleaned_image_path)
@@ -50,15 +128,85 @@ def clone_image(image_path: str, output_dir: str):
     #     output_path=regenerated_image_path,
     #     prompt=prompt,
     # )
-    html_code = generate_html(
-        height=analyzed_image.height,
-        width=analyzed_image.width,
-        text_blocks=analyzed_image.text_blocks,
-        image_path=os.path.basename(regenerated_image_path),
+    return regenerated_image_path
+
+
+def write_html(analyzed_image: AnalyzedImage, output_dir: str) -> str:
+    if HTML_MODE == "static":
+        html_code = render_static_html(
+            analyzed_image, os.path.join(output_dir, "regenerated.png")
+        )
+    else:
+        html_code = generate_html(
+            height=analyzed_image.height,
+            width=analyzed_image.width,
+            text_blocks=analyzed_image.text_blocks,
+            image_path="regenerated.png",
+        )
+    html_path = os.path.join(output_dir, "index.html")
+    _atomic_write(html_path, html_code)
+    return html_path
+
+
+@pipeline_stage("html")
+def stage_html(image_path: str, output_dir: str) -> str:
+    return write_html(_load_analysis(output_dir), output_dir)
+
+
+@pipeline_stage("composite")
+def stage_composite(image_path: str, output_dir: str) -> str:
+    analyzed_image = _load_analysis(output_dir)
+    return render_analyzed_image(
+        analyzed_image,
+        os.path.join(output_dir, "regenerated.png"),
+        os.path.join(output_dir, "composited.png"),
+    )
+
+
+@pipeline_stage("relayout")
+def stage_relayout(image_path: str, output_dir: str) -> str:
+    relayout(
+        _load_analysis(output_dir),
+        os.path.join(output_dir, "regenerated.png"),
+        output_dir,
     )
-    with open(os.path.join(output_dir, "index.html"), "w", encoding="utf-8") as f:
-        f.write(html_code)
+    return os.path.join(output_dir, "relayout")
+
+
+@pipeline_stage("localize")
+def stage_localize(image_path: str, output_dir: str) -> str:
+    localize(
+        _load_analysis(output_dir),
+        os.path.join(output_dir, "regenerated.png"),
+        output_dir,
+    )
+    return os.path.join(output_dir, "locales")
+
+
+PIPELINE_STAGES = [
+    ("analyze", stage_analyze),
+    ("mask", stage_mask),
+    ("erase", stage_erase),
+    ("regenerate", stage_regenerate),
+    ("html", stage_html),
+]
+if COMPOSITE_ENABLED:
+    PIPELINE_STAGES.append(("composite", stage_composite))
+if RELAYOUT_ENABLED:
+    PIPELINE_STAGES.append(("relayout", stage_relayout))
+if LOCALES:
+    PIPELINE_STAGES.append(("localize", stage_localize))
+
+
+def clone_image(image_path: str, output_dir: str):
+    os.makedirs(output_dir, exist_ok=True)
+    for _, stage in PIPELINE_STAGES:
+        stage(image_path, output_dir)
 
 
 if __name__ == "__main__":
+    if PROFILE_ENABLED:
+        profiler.start()
     clone_image("inputs/creo_01.png", os.path.join(CACHE_DIR, "creo_01"))
+    if PROFILE_ENABLED:
+        log_summary()
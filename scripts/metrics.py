@@ -0,0 +1,168 @@
+import functools
+import inspect
+import threading
+import time
+from collections.abc import Callable
+
+# Minimal Prometheus text-format metrics. Every metric keeps its samples per
+# label set; collectors compute values at scrape time.
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._values: dict[tuple, float] = {}
+        _REGISTRY.append(self)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        return self._header() + [
+            f"{self.name}{_format_labels(key)} {value:g}" for key, value in values.items()
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = buckets
+        self._series: dict[tuple, tuple[list[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts, total, observations = self._series.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            counts = [c + (value <= bound) for c, bound in zip(counts, self.buckets)]
+            self._series[key] = (counts, total + value, observations + 1)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            series = dict(self._series)
+        lines = self._header()
+        for key, (counts, total, observations) in series.items():
+            for bound, count in zip(self.buckets, counts):
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(key, (('le', f'{bound:g}'),))} {count}"
+                )
+            lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {observations}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total:g}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {observations}")
+        return lines
+
+
+_REGISTRY: list[_Metric] = []
+_COLLECTORS: list[Callable[[], None]] = []
+
+
+def register_collector(collect: Callable[[], None]):
+    # collect() runs on every scrape, before rendering, to refresh gauges.
+    _COLLECTORS.append(collect)
+
+
+def render() -> str:
+    for collect in _COLLECTORS:
+        collect()
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def timed(histogram: Histogram, failures: Counter, **labels):
+    # Times a call, or the full iteration of a generator, and counts
+    # exceptions it raises.
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    yield from fn(*args, **kwargs)
+                except Exception:
+                    failures.inc(**labels)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - started, **labels)
+
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                failures.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+
+        return wrapper
+
+    return decorator
+
+
+STAGE_SECONDS = Histogram("clone_stage_seconds", "Pipeline stage latency")
+STAGE_FAILURES = Counter("clone_stage_failures_total", "Pipeline stage failures")
+PROVIDER_SECONDS = Histogram(
+    "clone_provider_request_seconds", "External provider call latency"
+)
+PROVIDER_FAILURES = Counter(
+    "clone_provider_failures_total", "External provider calls that raised"
+)
+CACHE_LOOKUPS = Counter("clone_cache_lookups_total", "Cache lookups by cache and result")
+RETRIES = Counter("clone_retries_total", "Retried or hedged requests")
+
+
+def stage_timed(stage: str):
+    return timed(STAGE_SECONDS, STAGE_FAILURES, stage=stage)
+
+
+def provider_timed(provider: str, operation: str):
+    return timed(PROVIDER_SECONDS, PROVIDER_FAILURES, provider=provider, operation=operation)
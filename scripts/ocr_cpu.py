@@ -0,0 +1,89 @@
+import difflib
+import glob
+import os
+import time
+
+import easyocr
+import numpy as np
+import torch
+from PIL import Image
+from loguru import logger
+
+OCR_CPU_WORKERS = int(os.getenv("OCR_CPU_WORKERS", "0"))
+OCR_QUANTIZE = os.getenv("OCR_QUANTIZE", "1") == "1"
+OCR_INTEROP_THREADS = int(os.getenv("OCR_INTEROP_THREADS", "1"))
+
+
+def cpu_profile_enabled() -> bool:
+    return OCR_CPU_WORKERS > 0
+
+
+def configure_cpu_threads(workers: int = OCR_CPU_WORKERS) -> tuple[int, int]:
+    cpus = os.cpu_count() or 1
+    intra_op = max(1, cpus // max(1, workers))
+    torch.set_num_threads(intra_op)
+    try:
+        torch.set_num_interop_threads(OCR_INTEROP_THREADS)
+    except RuntimeError as e:
+        # Only settable before the first parallel op in the process.
+        logger.warning(f"Could not set inter-op threads: {e}")
+    logger.info(
+        f"OCR CPU profile: {workers} workers, "
+        f"{intra_op} intra-op / {torch.get_num_interop_threads()} inter-op threads"
+    )
+    return intra_op, torch.get_num_interop_threads()
+
+
+def reader_kwargs(quantize: bool = OCR_QUANTIZE) -> dict:
+    # EasyOCR applies dynamic int8 quantization to the recognizer and
+    # detector itself when running on CPU with quantize=True.
+    if not cpu_profile_enabled():
+        return {}
+    return {"gpu": False, "quantize": quantize}
+
+
+def _read_texts(reader: easyocr.Reader, image_path: str) -> tuple[list[str], float]:
+    array = np.array(Image.open(image_path).convert("RGB"))
+    started = time.perf_counter()
+    results = reader.readtext(array)
+    elapsed = time.perf_counter() - started
+    return [text for _, text, _ in results if len(text) > 3], elapsed
+
+
+def compare_quantized_accuracy(image_paths: list[str], languages: list[str]) -> dict:
+    full_reader = easyocr.Reader(languages, gpu=False, quantize=False)
+    quantized_reader = easyocr.Reader(languages, gpu=False, quantize=True)
+
+    similarities = []
+    full_seconds = 0.0
+    quantized_seconds = 0.0
+    for image_path in image_paths:
+        full_texts, full_elapsed = _read_texts(full_reader, image_path)
+        quantized_texts, quantized_elapsed = _read_texts(quantized_reader, image_path)
+        full_seconds += full_elapsed
+        quantized_seconds += quantized_elapsed
+        similarity = difflib.SequenceMatcher(
+            None, "\n".join(full_texts), "\n".join(quantized_texts)
+        ).ratio()
+        similarities.append(similarity)
+        logger.info(
+            f"{image_path}: similarity {similarity:.4f}, "
+            f"fp32 {full_elapsed:.2f}s, int8 {quantized_elapsed:.2f}s"
+        )
+
+    report = {
+        "images": len(image_paths),
+        "mean_text_similarity": float(np.mean(similarities)) if similarities else 1.0,
+        "accuracy_delta": 1.0 - float(np.mean(similarities)) if similarities else 0.0,
+        "fp32_seconds": full_seconds,
+        "int8_seconds": quantized_seconds,
+    }
+    logger.info(f"Quantized OCR accuracy report: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    from text_recognition import OCR_LANGUAGES
+
+    configure_cpu_threads(max(1, OCR_CPU_WORKERS))
+    compare_quantized_accuracy(sorted(glob.glob("inputs/*.png")), OCR_LANGUAGES)
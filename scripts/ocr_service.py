@@ -0,0 +1,163 @@
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from PIL import Image
+from loguru import logger
+
+from schema import TextBlockWithFontSize
+
+OCR_SOCKET_PATH = os.getenv("OCR_SOCKET_PATH", "/tmp/ads-ocr.sock")
+OCR_SERVICE_TIMEOUT = float(os.getenv("OCR_SERVICE_TIMEOUT", "120"))
+BATCH_WINDOW_S = 0.02
+MAX_BATCH_SIZE = 8
+
+_HEADER = struct.Struct("!I")
+
+
+class OCRServiceError(RuntimeError):
+    pass
+
+
+def _send_frame(sock: socket.socket, payload: bytes):
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("OCR service connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_frame(sock: socket.socket) -> bytes:
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return _recv_exact(sock, size)
+
+
+def is_service_available(socket_path: str = OCR_SOCKET_PATH) -> bool:
+    return os.path.exists(socket_path)
+
+
+def detect_text_remote(
+    image: Image.Image,
+    socket_path: str = OCR_SOCKET_PATH,
+) -> list[TextBlockWithFontSize]:
+    array = np.ascontiguousarray(np.array(image.convert("RGB")))
+    header = {"shape": list(array.shape), "dtype": str(array.dtype)}
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(OCR_SERVICE_TIMEOUT)
+        sock.connect(socket_path)
+        _send_frame(sock, json.dumps(header).encode("utf-8"))
+        _send_frame(sock, array.tobytes())
+        frame = _recv_frame(sock)
+
+    try:
+        response = json.loads(frame)
+        if "error" not in response:
+            return [TextBlockWithFontSize(**block) for block in response["text_blocks"]]
+    except (ValueError, KeyError, TypeError) as e:
+        raise OCRServiceError(f"Malformed OCR service response: {e}") from e
+    raise OCRServiceError(f"OCR service error: {response['error']}")
+
+
+class _Batcher:
+    def __init__(self, detect_batch, window_s: float, max_batch_size: int):
+        self._detect_batch = detect_batch
+        self._window_s = window_s
+        self._max_batch_size = max_batch_size
+        self._jobs: queue.Queue[tuple[np.ndarray, Future]] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, array: np.ndarray) -> Future:
+        future = Future()
+        self._jobs.put((array, future))
+        return future
+
+    def _collect(self) -> list[tuple[np.ndarray, Future]]:
+        batch = [self._jobs.get()]
+        deadline = time.monotonic() + self._window_s
+        while len(batch) < self._max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._jobs.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            arrays = [array for array, _ in batch]
+            logger.info(f"OCR service processing batch of {len(batch)}")
+            try:
+                results = self._detect_batch(arrays)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                # Retry one by one so a single bad image fails only its own
+                # request.
+                logger.warning(f"OCR batch failed, retrying images one by one: {e}")
+                for array, future in batch:
+                    try:
+                        future.set_result(self._detect_batch([array])[0])
+                    except Exception as item_error:
+                        future.set_exception(item_error)
+                continue
+            for (_, future), text_blocks in zip(batch, results):
+                future.set_result(text_blocks)
+
+
+class _OCRRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            header = json.loads(_recv_frame(self.request))
+            data = _recv_frame(self.request)
+            array = np.frombuffer(data, dtype=header["dtype"]).reshape(header["shape"])
+            text_blocks = self.server.batcher.submit(array).result()
+            response = {"text_blocks": [block.model_dump() for block in text_blocks]}
+        except Exception as e:
+            logger.exception("OCR service request failed")
+            response = {"error": str(e)}
+        _send_frame(self.request, json.dumps(response).encode("utf-8"))
+
+
+class _OCRServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path: str = OCR_SOCKET_PATH):
+    from text_recognition import _get_reader, detect_text_batch
+
+    _get_reader()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = _OCRServer(socket_path, _OCRRequestHandler)
+    server.batcher = _Batcher(detect_text_batch, BATCH_WINDOW_S, MAX_BATCH_SIZE)
+    logger.info(f"OCR service listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+from PIL import Image
+from loguru import logger
+
+from profiling import StageThreadPoolExecutor
+
+PROBE_SIDE = 1024
+TARGET_TEXT_HEIGHT = 32
+MIN_WORKING_SCALE = 0.25
+MAX_WORKING_SCALE = 3.0
+TILE_SIZE = 1536
+TILE_OVERLAP = 192
+TILE_WORKERS = int(os.getenv("OCR_TILE_WORKERS", "4"))
+SEAM_OVERLAP_RATIO = 0.5
+
+
+def _resize(array: np.ndarray, scale: float) -> np.ndarray:
+    if scale == 1.0:
+        return array
+    height, width = array.shape[:2]
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return np.array(Image.fromarray(array).resize(size, Image.Resampling.BICUBIC))
+
+
+def estimate_text_height(reader, array: np.ndarray) -> float | None:
+    height, width = array.shape[:2]
+    probe_scale = min(1.0, PROBE_SIDE / max(height, width))
+    horizontal_list, _ = reader.detect(_resize(array, probe_scale))
+    boxes = horizontal_list[0] if horizontal_list else []
+    if not boxes:
+        return None
+    heights = [(y_max - y_min) / probe_scale for _, _, y_min, y_max in boxes]
+    return float(np.median(heights))
+
+
+def choose_working_scale(text_height: float | None, longest_side: int) -> float:
+    if not text_height:
+        return 1.0
+    scale = TARGET_TEXT_HEIGHT / text_height
+    if scale > 1.0:
+        # Upscaling is for small images only; never upscale into tiling.
+        scale = min(scale, max(1.0, TILE_SIZE / longest_side))
+    return float(np.clip(scale, MIN_WORKING_SCALE, MAX_WORKING_SCALE))
+
+
+def _tile_starts(length: int) -> list[int]:
+    if length <= TILE_SIZE:
+        return [0]
+    step = TILE_SIZE - TILE_OVERLAP
+    starts = list(range(0, length - TILE_SIZE, step))
+    starts.append(length - TILE_SIZE)
+    return starts
+
+
+def _map_result(result, offset_x: int, offset_y: int, scale: float):
+    bbox, text, prob = result
+    mapped = [[(x + offset_x) / scale, (y + offset_y) / scale] for x, y in bbox]
+    return mapped, text, prob
+
+
+def _axis_aligned(bbox) -> tuple[float, float, float, float]:
+    xs = [x for x, _ in bbox]
+    ys = [y for _, y in bbox]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _area(box: tuple[float, float, float, float]) -> float:
+    x1, y1, x3, y3 = box
+    return max(0.0, x3 - x1) * max(0.0, y3 - y1)
+
+
+def _is_seam_duplicate(box_a, box_b) -> bool:
+    x1 = max(box_a[0], box_b[0])
+    y1 = max(box_a[1], box_b[1])
+    x3 = min(box_a[2], box_b[2])
+    y3 = min(box_a[3], box_b[3])
+    intersection = _area((x1, y1, x3, y3))
+    smaller = min(_area(box_a), _area(box_b))
+    return smaller > 0 and intersection / smaller >= SEAM_OVERLAP_RATIO
+
+
+def merge_seam_duplicates(results: list) -> list:
+    # Larger detections win: a word cut by a seam is complete in the other tile.
+    ordered = sorted(
+        results, key=lambda r: (_area(_axis_aligned(r[0])), r[2]), reverse=True
+    )
+    kept = []
+    kept_boxes = []
+    for result in ordered:
+        box = _axis_aligned(result[0])
+        if any(_is_seam_duplicate(box, other) for other in kept_boxes):
+            continue
+        kept.append(result)
+        kept_boxes.append(box)
+    kept.sort(key=lambda r: (_axis_aligned(r[0])[1], _axis_aligned(r[0])[0]))
+    return kept
+
+
+def working_resolution(reader, image: Image.Image | np.ndarray) -> tuple[np.ndarray, float]:
+    # Returns the image resized to the scale its text reads best at.
+    array = np.array(image)
+    text_height = estimate_text_height(reader, array)
+    scale = choose_working_scale(text_height, max(array.shape[:2]))
+    working = _resize(array, scale)
+    height, width = working.shape[:2]
+    logger.info(
+        f"OCR working resolution {width}x{height} (scale {scale:.2f}) "
+        f"for {array.shape[1]}x{array.shape[0]} image"
+    )
+    return working, scale
+
+
+def fits_one_tile(working: np.ndarray) -> bool:
+    return max(working.shape[:2]) <= TILE_SIZE
+
+
+def read_working(reader, working: np.ndarray, scale: float) -> list:
+    # Reads an image already at its working resolution; results are mapped
+    # back to the source image.
+    height, width = working.shape[:2]
+    tiles = [(x, y) for y in _tile_starts(height) for x in _tile_starts(width)]
+    if len(tiles) == 1:
+        return [_map_result(r, 0, 0, scale) for r in reader.readtext(working)]
+
+    def read_tile(origin: tuple[int, int]) -> list:
+        x, y = origin
+        tile = working[y : y + TILE_SIZE, x : x + TILE_SIZE]
+        return [_map_result(r, x, y, scale) for r in reader.readtext(tile)]
+
+    logger.info(f"OCR splitting image into {len(tiles)} tiles")
+    with StageThreadPoolExecutor(max_workers=TILE_WORKERS) as executor:
+        tile_results = list(executor.map(read_tile, tiles))
+    return merge_seam_duplicates([r for results in tile_results for r in results])
+
+
+def read_text_adaptive(reader, image: Image.Image | np.ndarray) -> list:
+    working, scale = working_resolution(reader, image)
+    return read_working(reader, working, scale)
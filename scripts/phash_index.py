@@ -0,0 +1,197 @@
+import json
+import os
+
+import numpy as np
+from PIL import Image
+from loguru import logger
+
+from image_context import image_context
+from incremental import fingerprint_blocks, reanalyze_blocks
+from schema import AnalyzedImage
+
+PHASH_INDEX_PATH = os.path.join("cache", "phash_index.json")
+MAX_PHASH_DISTANCE = 6
+MAX_DHASH_DISTANCE = 10
+REGION_DIFF_THRESHOLD = 12.0
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    k = np.arange(size)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * size))
+    matrix[0] *= 1 / np.sqrt(2)
+    return matrix * np.sqrt(2 / size)
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int("".join("1" if bit else "0" for bit in bits.ravel()), 2)
+
+
+def phash(image: Image.Image) -> int:
+    pixels = np.asarray(
+        image.convert("L").resize((32, 32), Image.Resampling.LANCZOS), dtype=float
+    )
+    dct = _DCT_32 @ pixels @ _DCT_32.T
+    low = dct[:8, :8].ravel()[1:]
+    return _bits_to_int(low > np.median(low))
+
+
+def dhash(image: Image.Image) -> int:
+    pixels = np.asarray(
+        image.convert("L").resize((9, 8), Image.Resampling.LANCZOS), dtype=float
+    )
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    def __init__(self):
+        self._root = None
+
+    def add(self, key: int, value):
+        node = [key, value, {}]
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming(key, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, key: int, max_distance: int) -> list[tuple[int, object]]:
+        if self._root is None:
+            return []
+        matches = []
+        stack = [self._root]
+        while stack:
+            node_key, value, children = stack.pop()
+            distance = hamming(key, node_key)
+            if distance <= max_distance:
+                matches.append((distance, value))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return sorted(matches, key=lambda match: match[0])
+
+
+class PerceptualHashIndex:
+    def __init__(self, index_path: str = PHASH_INDEX_PATH):
+        self.index_path = index_path
+        self._entries = []
+        self._tree = BKTree()
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                for entry in json.load(f):
+                    self._insert(entry)
+
+    def _insert(self, entry: dict):
+        self._entries.append(entry)
+        self._tree.add(int(entry["phash"], 16), entry)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, indent=4)
+        os.replace(temp_path, self.index_path)
+
+    def add(self, image_path: str, analysis_path: str):
+        image = image_context(image_path).gray
+        self._insert(
+            {
+                "phash": f"{phash(image):016x}",
+                "dhash": f"{dhash(image):016x}",
+                "image_path": image_path,
+                "analysis_path": analysis_path,
+            }
+        )
+        self._save()
+
+    def find(self, image_path: str) -> dict | None:
+        image = image_context(image_path).gray
+        image_dhash = dhash(image)
+        for distance, entry in self._tree.search(phash(image), MAX_PHASH_DISTANCE):
+            if not os.path.exists(entry["analysis_path"]):
+                continue
+            if hamming(image_dhash, int(entry["dhash"], 16)) <= MAX_DHASH_DISTANCE:
+                logger.info(f"{image_path} matches {entry['image_path']} at distance {distance}")
+                return entry
+        return None
+
+
+def _scale_box(box: list[int], scale_x: float, scale_y: float) -> list[int]:
+    x1, y1, x3, y3 = box
+    return [round(x1 * scale_x), round(y1 * scale_y), round(x3 * scale_x), round(y3 * scale_y)]
+
+
+def rescale_analysis(analyzed_image: AnalyzedImage, width: int, height: int) -> AnalyzedImage:
+    scale_x = width / analyzed_image.width
+    scale_y = height / analyzed_image.height
+    text_blocks = [
+        block.model_copy(
+            update={
+                "bounding_box": _scale_box(block.bounding_box, scale_x, scale_y),
+                "font_size": round(block.font_size * scale_y),
+                "line_spacing": block.line_spacing * scale_y,
+                "lines": [
+                    line.model_copy(
+                        update={"bounding_box": _scale_box(line.bounding_box, scale_x, scale_y)}
+                    )
+                    for line in block.lines
+                ],
+            }
+        )
+        for block in analyzed_image.text_blocks
+    ]
+    guides = [
+        guide.model_copy(
+            update={
+                "position": round(
+                    guide.position * (scale_y if guide.kind == "baseline" else scale_x)
+                )
+            }
+        )
+        for guide in analyzed_image.guides
+    ]
+    return AnalyzedImage(width=width, height=height, text_blocks=text_blocks, guides=guides)
+
+
+def changed_blocks(
+    image_path: str,
+    reference_path: str,
+    analyzed_image: AnalyzedImage,
+) -> list[int]:
+    image = np.asarray(image_context(image_path).gray, dtype=np.int16)
+    reference = image_context(reference_path).gray
+    reference = np.asarray(
+        reference.resize((image.shape[1], image.shape[0])), dtype=np.int16
+    )
+    changed = []
+    for i, block in enumerate(analyzed_image.text_blocks):
+        x1, y1, x3, y3 = block.bounding_box
+        region = np.abs(image[y1:y3, x1:x3] - reference[y1:y3, x1:x3])
+        if region.size == 0 or region.mean() > REGION_DIFF_THRESHOLD:
+            changed.append(i)
+    return changed
+
+
+def reuse_analysis(image_path: str, entry: dict) -> AnalyzedImage:
+    with open(entry["analysis_path"], "r", encoding="utf-8") as f:
+        source_analysis = AnalyzedImage(**json.load(f))
+    width, height = image_context(image_path).size
+    analyzed_image = rescale_analysis(source_analysis, width, height)
+    analyzed_image.block_fingerprints = fingerprint_blocks(
+        image_path, analyzed_image.text_blocks
+    )
+    dirty = changed_blocks(image_path, entry["image_path"], analyzed_image)
+    logger.info(f"Reusing analysis of {entry['image_path']}, re-verifying blocks {dirty}")
+    return reanalyze_blocks(image_path, analyzed_image, dirty)
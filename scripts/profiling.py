@@ -0,0 +1,220 @@
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from loguru import logger
+
+PROFILE_ENABLED = os.getenv("PROFILE", "0") == "1"
+PROFILE_INTERVAL_S = float(os.getenv("PROFILE_INTERVAL_S", "0.005"))
+PROFILE_FILE_NAME = "profile.collapsed"
+# The server keeps profiles for this many recent creatives.
+MAX_PROFILED_CREATIVES = 200
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    # Samples the Python stack of every thread that is inside a profiled
+    # stage and attributes it to that (creative, stage). Threads started
+    # through inherit_stage (StageThreadPoolExecutor, hedged calls) carry
+    # the stage of the thread that submitted the work. Native work such as
+    # PIL decode or torch shows up under the Python frame that called it.
+
+    def __init__(self, interval_s: float = PROFILE_INTERVAL_S):
+        self.interval_s = interval_s
+        self._lock = threading.Lock()
+        self._active: dict[int, tuple[str, str]] = {}
+        self._samples: OrderedDict[str, Counter] = OrderedDict()
+        self._stage_seconds: dict[str, dict[str, float]] = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._boundary_codes = set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        logger.info(f"Sampling profiler started, interval {self.interval_s * 1000:g} ms")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.sample()
+
+    def sample(self):
+        with self._lock:
+            active = dict(self._active)
+        if not active:
+            return
+        frames = sys._current_frames()
+        for thread_id, (creative, stage) in active.items():
+            frame = frames.get(thread_id)
+            stack = []
+            # Frames above the stage wrapper (CLI loop, scheduler, thread
+            # bootstrap) are the same for every sample and are dropped.
+            while frame is not None and frame.f_code not in self._boundary_codes:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if not stack:
+                continue
+            stack.append(stage)
+            stack.reverse()
+            with self._lock:
+                samples = self._samples.get(creative)
+                if samples is None:
+                    samples = self._samples[creative] = Counter()
+                    while len(self._samples) > MAX_PROFILED_CREATIVES:
+                        evicted, _ = self._samples.popitem(last=False)
+                        self._stage_seconds.pop(evicted, None)
+                samples[tuple(stack)] += 1
+
+    @contextmanager
+    def stage(self, creative: str, stage: str):
+        thread_id = threading.get_ident()
+        with self._lock:
+            previous = self._active.get(thread_id)
+            self._active[thread_id] = (creative, stage)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                if previous is None:
+                    self._active.pop(thread_id, None)
+                else:
+                    self._active[thread_id] = previous
+                stages = self._stage_seconds.setdefault(creative, {})
+                stages[stage] = stages.get(stage, 0.0) + elapsed
+
+    def current(self) -> tuple[str, str] | None:
+        with self._lock:
+            return self._active.get(threading.get_ident())
+
+    @contextmanager
+    def tagged(self, tag: tuple[str, str]):
+        # Attributes this thread's samples to tag without timing it as a
+        # stage; the submitting thread already times the stage.
+        thread_id = threading.get_ident()
+        with self._lock:
+            previous = self._active.get(thread_id)
+            self._active[thread_id] = tag
+        try:
+            yield
+        finally:
+            with self._lock:
+                if previous is None:
+                    self._active.pop(thread_id, None)
+                else:
+                    self._active[thread_id] = previous
+
+    def collapsed(self, creative: str) -> str:
+        # Brendan Gregg's collapsed format; flamegraph.pl and speedscope
+        # both read it.
+        with self._lock:
+            samples = dict(self._samples.get(creative, {}))
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in samples.items())
+
+    def write_collapsed(self, creative: str, path: str) -> str:
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed(creative))
+        os.replace(temp_path, path)
+        return path
+
+    def summary(self, top_n: int = 10, hot_frames: int = 5) -> list[dict]:
+        with self._lock:
+            stage_seconds = {creative: dict(s) for creative, s in self._stage_seconds.items()}
+            samples = {creative: Counter(s) for creative, s in self._samples.items()}
+        slowest = sorted(stage_seconds.items(), key=lambda item: -sum(item[1].values()))
+        report = []
+        for creative, stages in slowest[:top_n]:
+            leaves = Counter()
+            for stack, count in samples.get(creative, {}).items():
+                leaves[stack[-1]] += count
+            total_samples = sum(leaves.values()) or 1
+            report.append(
+                {
+                    "creative": creative,
+                    "seconds": sum(stages.values()),
+                    "stages": stages,
+                    "hot_frames": [
+                        {"frame": frame, "share": count / total_samples}
+                        for frame, count in leaves.most_common(hot_frames)
+                    ],
+                }
+            )
+        return report
+
+
+profiler = SamplingProfiler()
+
+
+def profiled_stage(stage: str) -> Callable:
+    # Stages take (image_path, output_dir); the output directory names the
+    # creative and receives its collapsed stacks after every stage.
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(image_path: str, output_dir: str):
+            if not profiler.running:
+                return fn(image_path, output_dir)
+            with profiler.stage(output_dir, stage):
+                result = fn(image_path, output_dir)
+            profiler.write_collapsed(output_dir, os.path.join(output_dir, PROFILE_FILE_NAME))
+            return result
+
+        profiler._boundary_codes.add(wrapper.__code__)
+        return wrapper
+
+    return decorator
+
+
+def _run_in_stage(tag: tuple[str, str], fn: Callable, *args, **kwargs):
+    with profiler.tagged(tag):
+        return fn(*args, **kwargs)
+
+
+profiler._boundary_codes.add(_run_in_stage.__code__)
+
+
+def inherit_stage(fn: Callable) -> Callable:
+    # Wraps fn to run under the calling thread's stage, for work handed to
+    # other threads.
+    tag = profiler.current() if profiler.running else None
+    if tag is None:
+        return fn
+    return functools.partial(_run_in_stage, tag, fn)
+
+
+class StageThreadPoolExecutor(ThreadPoolExecutor):
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(inherit_stage(fn), *args, **kwargs)
+
+
+def log_summary(top_n: int = 10) -> list[dict]:
+    report = profiler.summary(top_n)
+    for entry in report:
+        stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in entry["stages"].items())
+        hot = ", ".join(f"{f['frame']} {f['share']:.0%}" for f in entry["hot_frames"][:3])
+        logger.info(f"{entry['creative']}: {entry['seconds']:.2f}s ({stages}); hot: {hot}")
+    return report
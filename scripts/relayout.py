@@ -0,0 +1,296 @@
+import json
+import math
+import os
+
+from PIL import Image, ImageFilter
+from loguru import logger
+
+from compositor import get_font, render_analyzed_image, wrap_text
+from html_render import block_lines, render_static_html
+from image_context import image_context
+from image_generation import outpaint_image_flux_pro_fill
+from layout_guides import apply_guides
+from profiling import StageThreadPoolExecutor
+from schema import AnalyzedImage, TextBlockWithFontNameAndColor
+
+TARGET_SIZES = {
+    "1x1": (1080, 1080),
+    "4x5": (1080, 1350),
+    "9x16": (1080, 1920),
+    "1.91x1": (1200, 628),
+}
+RELAYOUT_FORMATS = os.getenv("RELAYOUT_FORMATS", ",".join(TARGET_SIZES)).split(",")
+# "fal" outpaints missing background with Flux Pro Fill, "blur" fills it
+# locally with a blurred stretch of the source.
+RELAYOUT_FILL = os.getenv("RELAYOUT_FILL", "fal")
+# Crop instead of outpainting when the crop keeps at least this much of the
+# source background.
+RELAYOUT_MIN_CROP_KEEP = float(os.getenv("RELAYOUT_MIN_CROP_KEEP", "0.8"))
+MARGIN_FRACTION = 0.04
+MIN_FONT_SIZE = 10
+MAX_FIT_ATTEMPTS = 8
+OUTPAINT_OVERLAP = 8
+
+
+def _crop_to_aspect(background: Image.Image, target_size: tuple[int, int]) -> Image.Image:
+    width, height = background.size
+    target_width, target_height = target_size
+    if width * target_height > height * target_width:
+        crop_width = round(height * target_width / target_height)
+        left = (width - crop_width) // 2
+        box = (left, 0, left + crop_width, height)
+    else:
+        crop_height = round(width * target_height / target_width)
+        top = (height - crop_height) // 2
+        box = (0, top, width, top + crop_height)
+    return background.crop(box).resize(target_size, Image.Resampling.LANCZOS)
+
+
+def _outpaint_to_aspect(
+    background: Image.Image, target_size: tuple[int, int], work_prefix: str
+) -> Image.Image:
+    width, height = background.size
+    target_width, target_height = target_size
+    scale = min(target_width / width, target_height / height)
+    fitted = background.resize(
+        (round(width * scale), round(height * scale)), Image.Resampling.LANCZOS
+    )
+    offset = (
+        (target_width - fitted.width) // 2,
+        (target_height - fitted.height) // 2,
+    )
+
+    # Blurred cover fill: used as-is for the local mode and as the starting
+    # canvas for the fal fill so the model sees plausible colors at the seams.
+    cover_scale = max(target_width / width, target_height / height)
+    canvas = _crop_to_aspect(
+        background.resize(
+            (math.ceil(width * cover_scale), math.ceil(height * cover_scale))
+        ),
+        target_size,
+    ).filter(ImageFilter.GaussianBlur(radius=min(target_size) / 20))
+    canvas.paste(fitted, offset)
+    if RELAYOUT_FILL != "fal":
+        return canvas
+
+    mask = Image.new("L", target_size, 255)
+    mask.paste(
+        0,
+        (
+            offset[0] + OUTPAINT_OVERLAP,
+            offset[1] + OUTPAINT_OVERLAP,
+            offset[0] + fitted.width - OUTPAINT_OVERLAP,
+            offset[1] + fitted.height - OUTPAINT_OVERLAP,
+        ),
+    )
+    canvas_path = f"{work_prefix}_canvas.png"
+    mask_path = f"{work_prefix}_mask.png"
+    filled_path = f"{work_prefix}_filled.png"
+    canvas.save(canvas_path)
+    mask.save(mask_path)
+    outpaint_image_flux_pro_fill(canvas_path, mask_path, filled_path)
+    filled = Image.open(filled_path).convert("RGB").resize(target_size)
+    # Keep the original pixels where nothing had to be generated. The mask
+    # covers the whole target, so only its part under the source is used.
+    keep_mask = Image.eval(mask, lambda value: 255 - value).crop(
+        (offset[0], offset[1], offset[0] + fitted.width, offset[1] + fitted.height)
+    )
+    filled.paste(fitted, offset, keep_mask)
+    return filled
+
+
+def relayout_background(
+    background_path: str, target_size: tuple[int, int], output_path: str
+) -> str:
+    if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(
+        background_path
+    ):
+        return output_path
+
+    background = image_context(background_path).rgb
+    width, height = background.size
+    source_aspect = width / height
+    target_aspect = target_size[0] / target_size[1]
+    keep = min(source_aspect, target_aspect) / max(source_aspect, target_aspect)
+    if keep >= RELAYOUT_MIN_CROP_KEEP:
+        result = _crop_to_aspect(background, target_size)
+    else:
+        logger.info(
+            f"Outpainting {background_path} to {target_size[0]}x{target_size[1]} "
+            f"(crop would keep {keep:.0%})"
+        )
+        result = _outpaint_to_aspect(
+            background, target_size, os.path.splitext(output_path)[0]
+        )
+    temp_path = f"{output_path}.tmp.png"
+    result.save(temp_path)
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+def _anchored_start(
+    start: float,
+    end: float,
+    extent: int,
+    target_extent: int,
+    scale: float,
+    size: float,
+    alignment: str = "center",
+) -> float:
+    # Blocks in the first or last third stay pinned to that edge, the rest
+    # keep the offset of their aligned edge from the center.
+    center = (start + end) / 2
+    if center < extent / 3:
+        return start * scale
+    if center > 2 * extent / 3:
+        return target_extent - (extent - end) * scale - size
+    if alignment == "left":
+        return target_extent / 2 + (start - extent / 2) * scale
+    if alignment == "right":
+        return target_extent / 2 + (end - extent / 2) * scale - size
+    return target_extent / 2 + (center - extent / 2) * scale - size / 2
+
+
+def _layout_block(
+    block: TextBlockWithFontNameAndColor,
+    source_size: tuple[int, int],
+    target_size: tuple[int, int],
+    font_scale: float,
+    margin: int,
+) -> TextBlockWithFontNameAndColor:
+    width, height = source_size
+    target_width, target_height = target_size
+    scale_x, scale_y = target_width / width, target_height / height
+    x1, y1, x3, y3 = block.bounding_box
+
+    font_size = max(MIN_FONT_SIZE, round(block.font_size * font_scale))
+    line_spacing = block.line_spacing * font_size / block.font_size
+    max_width = min((x3 - x1) * max(scale_x, font_scale), target_width - 2 * margin)
+    lines = wrap_text(block.font_name, font_size, block_lines(block), max_width)
+    font = get_font(block.font_name, font_size)
+    box_width = min(
+        max(font.getlength(line) for line in lines), target_width - 2 * margin
+    )
+    box_height = len(lines) * (font_size + line_spacing) - line_spacing
+
+    new_x1 = _anchored_start(
+        x1, x3, width, target_width, scale_x, box_width, block.alignment
+    )
+    new_y1 = _anchored_start(y1, y3, height, target_height, scale_y, box_height)
+    new_x1 = min(max(new_x1, margin), target_width - margin - box_width)
+    # Bottom-pinned blocks can start past the lower margin when the source
+    # text sits closer to the edge; a block taller than the safe area keeps
+    # its top at the margin so the fit check in relayout_text shrinks it.
+    new_y1 = max(min(new_y1, target_height - margin - box_height), margin)
+    return block.model_copy(
+        update={
+            "text": "\\n".join(lines),
+            "bounding_box": [
+                round(new_x1),
+                round(new_y1),
+                math.ceil(new_x1 + box_width),
+                math.ceil(new_y1 + box_height),
+            ],
+            "font_size": font_size,
+            "line_spacing": line_spacing if len(lines) > 1 else 0.0,
+            "lines": [],
+        }
+    )
+
+
+def _resolve_overlaps(
+    blocks: list[TextBlockWithFontNameAndColor], gap: int
+) -> list[TextBlockWithFontNameAndColor]:
+    placed = []
+    for block in sorted(blocks, key=lambda b: b.bounding_box[1]):
+        x1, y1, x3, y3 = block.bounding_box
+        for other in placed:
+            ox1, oy1, ox3, oy3 = other.bounding_box
+            if x1 < ox3 and ox1 < x3 and y1 < oy3 + gap and oy1 < y3:
+                shift = oy3 + gap - y1
+                y1, y3 = y1 + shift, y3 + shift
+        placed.append(block.model_copy(update={"bounding_box": [x1, y1, x3, y3]}))
+    return placed
+
+
+def relayout_text(
+    analyzed_image: AnalyzedImage, target_size: tuple[int, int]
+) -> AnalyzedImage:
+    source_size = (analyzed_image.width, analyzed_image.height)
+    target_width, target_height = target_size
+    margin = round(min(target_size) * MARGIN_FRACTION)
+    scale_x = target_width / source_size[0]
+    scale_y = target_height / source_size[1]
+    font_scale = math.sqrt(scale_x * scale_y)
+
+    for _ in range(MAX_FIT_ATTEMPTS):
+        blocks = _resolve_overlaps(
+            apply_guides(
+                [
+                    _layout_block(block, source_size, target_size, font_scale, margin)
+                    for block in analyzed_image.text_blocks
+                ],
+                analyzed_image.guides,
+            ),
+            gap=margin // 2,
+        )
+        if all(block.bounding_box[3] <= target_height - margin for block in blocks):
+            break
+        font_scale *= 0.9
+    else:
+        logger.warning(
+            f"Text does not fit {target_width}x{target_height} "
+            f"after {MAX_FIT_ATTEMPTS} attempts"
+        )
+
+    return AnalyzedImage(width=target_width, height=target_height, text_blocks=blocks)
+
+
+def _relayout_format(
+    analyzed_image: AnalyzedImage,
+    background_path: str,
+    relayout_dir: str,
+    format_name: str,
+) -> str:
+    target_size = TARGET_SIZES[format_name]
+    format_dir = os.path.join(relayout_dir, format_name)
+    os.makedirs(format_dir, exist_ok=True)
+    format_background_path = relayout_background(
+        background_path,
+        target_size,
+        os.path.join(relayout_dir, "backgrounds", f"{format_name}.png"),
+    )
+
+    layout = relayout_text(analyzed_image, target_size)
+    with open(os.path.join(format_dir, "analyzed_image.json"), "w", encoding="utf-8") as f:
+        json.dump(layout.model_dump(), f, indent=4)
+    with open(os.path.join(format_dir, "index.html"), "w", encoding="utf-8") as f:
+        f.write(render_static_html(layout, format_background_path, inline_background=True))
+    return render_analyzed_image(
+        layout, format_background_path, os.path.join(format_dir, "composited.png")
+    )
+
+
+def relayout(
+    analyzed_image: AnalyzedImage,
+    background_path: str,
+    output_dir: str,
+    formats: list[str] = RELAYOUT_FORMATS,
+) -> dict[str, str]:
+    # All formats share the loaded analysis, the font and glyph caches and the
+    # per-aspect backgrounds under relayout/backgrounds, which are only
+    # recomputed when the source background changes.
+    unknown = [name for name in formats if name not in TARGET_SIZES]
+    if unknown:
+        raise ValueError(f"Unknown formats: {unknown}")
+    relayout_dir = os.path.join(output_dir, "relayout")
+    os.makedirs(os.path.join(relayout_dir, "backgrounds"), exist_ok=True)
+
+    with StageThreadPoolExecutor(max_workers=len(formats) or 1) as executor:
+        paths = executor.map(
+            lambda name: _relayout_format(
+                analyzed_image, background_path, relayout_dir, name
+            ),
+            formats,
+        )
+        return dict(zip(formats, paths))
@@ -0,0 +1,161 @@
+import os
+import queue
+import threading
+import time
+from collections.abc import Callable
+
+from loguru import logger
+
+from main import PIPELINE_STAGES
+
+# Network-bound stages get more workers than the CPU-bound OCR stage so one
+# creative's OCR overlaps with others waiting on the eraser and redux.
+DEFAULT_STAGE_WORKERS = {
+    "analyze": 1,
+    "mask": 1,
+    "erase": 4,
+    "regenerate": 4,
+    "html": 2,
+    "composite": 1,
+    "relayout": 2,
+    "localize": 2,
+}
+STAGE_QUEUE_SIZE = int(os.getenv("STAGE_QUEUE_SIZE", "2"))
+STATUS_INTERVAL_S = float(os.getenv("PIPELINE_STATUS_INTERVAL_S", "10"))
+
+_DONE = object()
+
+
+def stage_workers_from_env() -> dict[str, int]:
+    # STAGE_WORKERS="erase:6,regenerate:8" overrides the defaults.
+    workers = dict(DEFAULT_STAGE_WORKERS)
+    for item in os.getenv("STAGE_WORKERS", "").split(","):
+        if ":" in item:
+            name, count = item.split(":", 1)
+            workers[name.strip()] = int(count)
+    return workers
+
+
+class PipelineScheduler:
+    # Runs each stage in its own worker pool with a bounded queue in front of
+    # it. A full queue blocks the previous stage, so fast stages cannot run
+    # ahead of slow ones by more than STAGE_QUEUE_SIZE creatives.
+
+    def __init__(
+        self,
+        stages: list[tuple[str, Callable[[str, str], str]]] = PIPELINE_STAGES,
+        workers: dict[str, int] | None = None,
+        queue_size: int = STAGE_QUEUE_SIZE,
+        should_skip: Callable[[str, str], bool] | None = None,
+        on_event: Callable[..., None] | None = None,
+    ):
+        self.stages = stages
+        self.workers = {**stage_workers_from_env(), **(workers or {})}
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.should_skip = should_skip or (lambda output_dir, stage_name: False)
+        self.on_event = on_event or (lambda *args, **kwargs: None)
+        self._busy = {name: 0 for name, _ in stages}
+        self._completed = {name: 0 for name, _ in stages}
+        self._lock = threading.Lock()
+        self._failed: list[str] = []
+
+    def _worker_count(self, stage_name: str) -> int:
+        return max(1, self.workers.get(stage_name, 1))
+
+    def _run_stage(self, index: int, remaining: list[int]):
+        stage_name, stage = self.stages[index]
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.stages) else None
+
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                with self._lock:
+                    remaining[index] -= 1
+                    last = remaining[index] == 0
+                # The last worker of a stage shuts the next stage down.
+                if last and outbox is not None:
+                    for _ in range(self._worker_count(self.stages[index + 1][0])):
+                        outbox.put(_DONE)
+                return
+
+            image_path, output_dir = item
+            if not self.should_skip(output_dir, stage_name):
+                with self._lock:
+                    self._busy[stage_name] += 1
+                self.on_event(output_dir, stage_name, "running")
+                try:
+                    artifact = stage(image_path, output_dir)
+                except Exception as e:
+                    logger.exception(f"{output_dir}: stage {stage_name} failed")
+                    self.on_event(output_dir, stage_name, "failed", error=repr(e))
+                    with self._lock:
+                        self._busy[stage_name] -= 1
+                        self._failed.append(output_dir)
+                    continue
+                self.on_event(output_dir, stage_name, "done", artifact=artifact)
+                with self._lock:
+                    self._busy[stage_name] -= 1
+            with self._lock:
+                self._completed[stage_name] += 1
+            if outbox is not None:
+                outbox.put(item)
+
+    def status(self) -> dict[str, dict[str, int]]:
+        with self._lock:
+            return {
+                name: {
+                    "queued": self.queues[i].qsize(),
+                    "busy": self._busy[name],
+                    "workers": self._worker_count(name),
+                    "completed": self._completed[name],
+                }
+                for i, (name, _) in enumerate(self.stages)
+            }
+
+    def _report(self, stop: threading.Event):
+        while not stop.wait(STATUS_INTERVAL_S):
+            logger.info(
+                "pipeline "
+                + " | ".join(
+                    f"{name} q={s['queued']} busy={s['busy']}/{s['workers']} done={s['completed']}"
+                    for name, s in self.status().items()
+                )
+            )
+
+    def run(self, items: list[tuple[str, str]]) -> list[str]:
+        # Returns the output directories of failed creatives.
+        for _, output_dir in items:
+            os.makedirs(output_dir, exist_ok=True)
+        remaining = [self._worker_count(name) for name, _ in self.stages]
+        threads = [
+            threading.Thread(
+                target=self._run_stage,
+                args=(index, remaining),
+                name=f"stage-{name}-{n}",
+                daemon=True,
+            )
+            for index, (name, _) in enumerate(self.stages)
+            for n in range(self._worker_count(name))
+        ]
+        stop = threading.Event()
+        reporter = threading.Thread(target=self._report, args=(stop,), daemon=True)
+        for thread in threads:
+            thread.start()
+        reporter.start()
+
+        started = time.perf_counter()
+        # Blocks while the first queue is full.
+        for item in items:
+            self.queues[0].put(item)
+        for _ in range(remaining[0]):
+            self.queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+        stop.set()
+
+        logger.info(
+            f"Pipelined {len(items)} creatives in {time.perf_counter() - started:.1f}s, "
+            f"{len(self._failed)} failed"
+        )
+        return list(self._failed)
@@ -2,10 +2,19 @@ from pydantic import BaseModel
 from typing import Literal
 
 
+class LineBox(BaseModel):
+    # One EasyOCR detection; several are merged into a block.
+    text: str
+    bounding_box: list[int]
+    confidence: float
+
+
 class TextBlockWithFontSize(BaseModel):
     text: str
     bounding_box: list[int]
     font_size: int
+    confidence: float = 1.0
+    lines: list[LineBox] = []
 
 
 class TextBlockWithFontSizeAndLineSpacing(TextBlockWithFontSize):
@@ -30,7 +39,15 @@ class TextBlockWithFontNameAndColor(TextBlockWithFontName):
     color: str
 
 
+class LayoutGuide(BaseModel):
+    kind: Literal["left", "center", "right", "baseline"]
+    position: int
+    block_ids: list[int]
+
+
 class AnalyzedImage(BaseModel):
     width: int
     height: int
     text_blocks: list[TextBlockWithFontNameAndColor]
+    block_fingerprints: list[str] = []
+    guides: list[LayoutGuide] = []
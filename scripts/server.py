@@ -0,0 +1,217 @@
+import asyncio
+import os
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse
+from fastapi.staticfiles import StaticFiles
+from loguru import logger
+from starlette.datastructures import UploadFile
+
+from admission import AdmissionController, AdmissionRejected
+from main import clone_image
+from metrics import CACHE_LOOKUPS, Counter, Gauge, register_collector, render
+from profiling import PROFILE_ENABLED, profiler
+from single_flight import SingleFlight, job_key
+
+app = FastAPI()
+CACHE_DIR = "static"
+RESULT_TTL_S = float(os.getenv("RESULT_TTL_S", "3600"))
+MAX_IN_FLIGHT_JOBS = int(os.getenv("MAX_IN_FLIGHT_JOBS", "4"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "16"))
+PER_CLIENT_MAX_JOBS = int(os.getenv("PER_CLIENT_MAX_JOBS", "4"))
+QUEUE_TIMEOUT_S = float(os.getenv("QUEUE_TIMEOUT_S", "120"))
+# Reading an upload is cheap next to a job, so it has its own wider limit.
+MAX_UPLOAD_READS = int(os.getenv("MAX_UPLOAD_READS", "32"))
+PER_CLIENT_MAX_UPLOAD_READS = int(os.getenv("PER_CLIENT_MAX_UPLOAD_READS", "4"))
+UPLOAD_QUEUE_TIMEOUT_S = float(os.getenv("UPLOAD_QUEUE_TIMEOUT_S", "10"))
+# X-Client-Id is only trusted from these proxy addresses; anyone else is
+# identified by their remote address.
+TRUSTED_PROXIES = {
+    host.strip() for host in os.getenv("TRUSTED_PROXIES", "").split(",") if host.strip()
+}
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+app.mount("/static", StaticFiles(directory=CACHE_DIR), name="static")
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+jobs = SingleFlight(ttl_s=RESULT_TTL_S)
+if PROFILE_ENABLED:
+    profiler.start()
+admission = AdmissionController(
+    max_in_flight=MAX_IN_FLIGHT_JOBS,
+    max_queued=MAX_QUEUED_JOBS,
+    per_client_limit=PER_CLIENT_MAX_JOBS,
+    queue_timeout_s=QUEUE_TIMEOUT_S,
+)
+uploads = AdmissionController(
+    max_in_flight=MAX_UPLOAD_READS,
+    max_queued=MAX_UPLOAD_READS,
+    per_client_limit=PER_CLIENT_MAX_UPLOAD_READS,
+    queue_timeout_s=UPLOAD_QUEUE_TIMEOUT_S,
+)
+
+
+DISK_USAGE_TTL_S = 30.0
+
+JOBS_IN_FLIGHT = Gauge("clone_jobs_in_flight", "Clone jobs holding an admission slot")
+JOBS_QUEUED = Gauge("clone_jobs_queued", "Clone jobs waiting for an admission slot")
+UPLOADS_IN_FLIGHT = Gauge("clone_upload_reads_in_flight", "Clone uploads being read")
+JOBS_COALESCED = Gauge("clone_jobs_single_flight", "Distinct clone jobs running")
+STATIC_DISK_BYTES = Gauge("clone_static_disk_bytes", f"Bytes stored under {CACHE_DIR}/")
+ADMISSION_REJECTIONS = Counter(
+    "clone_admission_rejections_total",
+    "Clone requests rejected by admission control, by phase (upload or job)",
+)
+JOB_FAILURES = Counter("clone_job_failures_total", "Clone jobs that raised")
+_disk_usage = {"bytes": 0, "measured_at": float("-inf")}
+
+
+def _static_disk_bytes() -> int:
+    # Walking static/ on every scrape gets slow as sessions pile up.
+    if time.monotonic() - _disk_usage["measured_at"] > DISK_USAGE_TTL_S:
+        total = 0
+        for root, _, files in os.walk(CACHE_DIR):
+            for file_name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, file_name))
+                except OSError:
+                    pass
+        _disk_usage.update(bytes=total, measured_at=time.monotonic())
+    return _disk_usage["bytes"]
+
+
+def _collect_server_metrics():
+    JOBS_IN_FLIGHT.set(admission.in_flight)
+    JOBS_QUEUED.set(admission.queued)
+    UPLOADS_IN_FLIGHT.set(uploads.in_flight)
+    JOBS_COALESCED.set(jobs.in_flight())
+    STATIC_DISK_BYTES.set(_static_disk_bytes())
+
+
+register_collector(_collect_server_metrics)
+
+
+def _client_id(request: Request) -> str:
+    host = request.client.host if request.client else "anonymous"
+    if host in TRUSTED_PROXIES:
+        return request.headers.get("X-Client-Id") or host
+    return host
+
+
+def _run_clone(content: bytes, key: str, extension: str) -> dict:
+    # Every run gets a fresh directory, so a repeat upload after the cached
+    # result expires cannot pick up an earlier run's outputs.
+    session_id = f"{key[:16]}-{uuid.uuid4().hex[:16]}"
+    session_dir = os.path.join(CACHE_DIR, session_id)
+    os.makedirs(session_dir)
+    logger.info(f"/generate-html job {key[:16]} running in session {session_id}")
+    input_image_path = os.path.join(session_dir, f"input{extension}")
+    with open(input_image_path, "wb") as f:
+        f.write(content)
+
+    clone_image(input_image_path, session_dir)
+
+    with open(os.path.join(session_dir, "index.html"), "r", encoding="utf-8") as f:
+        html_content = f.read()
+    image_url = os.path.join(session_dir, "regenerated.png")
+    return {"html": html_content, "imageUrl": image_url}
+
+
+async def _read_upload(request: Request) -> tuple[bytes, str]:
+    # Reads at most MAX_UPLOAD_BYTES of the "image" form field. The form
+    # parser spools file parts to disk, so an oversized upload never sits
+    # in memory.
+    form = await request.form(max_files=1)
+    try:
+        image = form.get("image")
+        if not isinstance(image, UploadFile):
+            raise HTTPException(status_code=422, detail="Missing image file")
+        content = await image.read(MAX_UPLOAD_BYTES + 1)
+        extension = os.path.splitext(image.filename or "")[1].lower() or ".png"
+    finally:
+        await form.close()
+    if len(content) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Upload is too large")
+    return content, extension
+
+
+def _run_job(content: bytes, key: str, extension: str):
+    async def run() -> dict:
+        try:
+            return await asyncio.to_thread(_run_clone, content, key, extension)
+        except Exception:
+            JOB_FAILURES.inc()
+            raise
+
+    return run
+
+
+@app.post("/generate-html")
+async def generate_html(request: Request):
+    client_id = _client_id(request)
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Upload is too large")
+
+    # Every caller takes an upload slot on its own client id before its body
+    # is read. Only a caller that starts a job also takes a job slot, so
+    # cache hits and identical concurrent uploads share one.
+    phase = "upload"
+    try:
+        async with uploads.admit(client_id):
+            content, extension = await _read_upload(request)
+        key = job_key(content, {"extension": extension})
+        phase = "job"
+        result, status = await jobs.run(
+            key,
+            _run_job(content, key, extension),
+            slot=lambda: admission.admit(client_id),
+        )
+    except AdmissionRejected as e:
+        logger.warning(f"/generate-html {phase} rejected for {client_id}: {e.reason}")
+        ADMISSION_REJECTIONS.inc(phase=phase, status=e.status_code)
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    CACHE_LOOKUPS.inc(cache="generate_html", result=status)
+    logger.info(f"/generate-html job {key[:16]}: {status}")
+    return result
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/profile")
+async def profile_summary(top: int = 10):
+    if not profiler.running:
+        raise HTTPException(status_code=404, detail="Profiling is disabled, set PROFILE=1")
+    return profiler.summary(top)
+
+
+@app.get("/images/{image_name}")
+async def get_image(image_name: str):
+    image_path = os.path.join(CACHE_DIR, image_name)
+    if os.path.exists(image_path):
+        return FileResponse(image_path)
+    raise HTTPException(status_code=404, detail="Image not found")
+
+
+if __name__ == "__main__":
+    uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=True)
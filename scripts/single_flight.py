@@ -0,0 +1,75 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import AbstractAsyncContextManager, AsyncExitStack
+from typing import Any
+
+
+def job_key(content: bytes, options: dict) -> str:
+    digest = hashlib.sha256(content)
+    digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    # Coalesces concurrent calls with the same key onto one task and serves
+    # completed results until they are ttl_s seconds old.
+
+    def __init__(self, ttl_s: float):
+        self.ttl_s = ttl_s
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self._completed: dict[str, tuple[float, Any]] = {}
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._completed.items() if expires <= now]:
+            del self._completed[key]
+
+    def _on_done(self, key: str, task: asyncio.Task):
+        self._in_flight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self._completed[key] = (time.monotonic() + self.ttl_s, task.result())
+
+    async def run(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        slot: Callable[[], AbstractAsyncContextManager] | None = None,
+    ) -> tuple[Any, str]:
+        # slot is only entered by a caller about to start a job, before the
+        # task exists, so its rejection stays with that caller; the task
+        # holds it until the job ends. Hits and joiners never take one.
+        while True:
+            self._evict_expired()
+            if key in self._completed:
+                return self._completed[key][1], "hit"
+
+            task = self._in_flight.get(key)
+            status = "joined"
+            if task is None:
+                stack = AsyncExitStack()
+                if slot is not None:
+                    await stack.enter_async_context(slot())
+                    if key in self._in_flight or key in self._completed:
+                        # Started by another caller while this one waited.
+                        await stack.aclose()
+                        continue
+                task = asyncio.ensure_future(self._run_holding(stack, fn))
+                task.add_done_callback(lambda done: self._on_done(key, done))
+                self._in_flight[key] = task
+                status = "miss"
+            # Shielded so a disconnecting client does not cancel the shared
+            # job. A failure is shared with the joiners too: rerunning it once
+            # per joiner would turn one failing job into as many paid reruns.
+            # Failed jobs are not cached, so a retry starts a fresh attempt.
+            return await asyncio.shield(task), status
+
+    @staticmethod
+    async def _run_holding(stack: AsyncExitStack, fn: Callable[[], Awaitable[Any]]) -> Any:
+        async with stack:
+            return await fn()
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
@@ -0,0 +1,127 @@
+import os
+import re
+import threading
+from functools import lru_cache
+
+from loguru import logger
+
+SPELLING_DICTIONARY_PATH = os.getenv(
+    "SPELLING_DICTIONARY_PATH", os.path.join("dictionaries", "frequency_dictionary_en.txt")
+)
+MAX_EDIT_DISTANCE = 2
+
+_WORD_PATTERN = re.compile(r"[A-Za-z0-9]+(?:'[A-Za-z]+)?")
+
+
+def _deletes(word: str, max_distance: int) -> set[str]:
+    deletes = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {
+            candidate[:i] + candidate[i + 1 :]
+            for candidate in frontier
+            for i in range(len(candidate))
+        }
+        deletes |= frontier
+    return deletes
+
+
+def _edit_distance(a: str, b: str) -> int:
+    # Optimal string alignment distance (Damerau-Levenshtein with adjacent swaps).
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (
+                previous_previous is not None
+                and i > 1
+                and j > 1
+                and a[i - 1] == b[j - 2]
+                and a[i - 2] == b[j - 1]
+            ):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class SpellingIndex:
+    def __init__(self, frequencies: dict[str, int], max_distance: int = MAX_EDIT_DISTANCE):
+        self.frequencies = frequencies
+        self.max_distance = max_distance
+        self._deletes: dict[str, list[str]] | None = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str) -> "SpellingIndex":
+        frequencies = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[1].isdigit():
+                    frequencies[parts[0].casefold()] = int(parts[1])
+        return cls(frequencies)
+
+    def is_known(self, word: str) -> bool:
+        return word.casefold() in self.frequencies
+
+    def _deletion_index(self) -> dict[str, list[str]]:
+        # Only suggestions need the deletion index, so it is built on first
+        # lookup rather than with the dictionary.
+        with self._lock:
+            if self._deletes is None:
+                deletes: dict[str, list[str]] = {}
+                for word in self.frequencies:
+                    for delete in _deletes(word, self.max_distance):
+                        deletes.setdefault(delete, []).append(word)
+                self._deletes = deletes
+            return self._deletes
+
+    def lookup(self, word: str) -> str | None:
+        # Closest dictionary word within max_distance. This is a suggestion
+        # only: brand names and ad copy are often near a dictionary word
+        # ("Nike" -> "like"), so it is never applied automatically.
+        word = word.casefold()
+        if word in self.frequencies:
+            return word
+        index = self._deletion_index()
+        best = None
+        for delete in _deletes(word, self.max_distance):
+            for candidate in index.get(delete, ()):
+                distance = _edit_distance(word, candidate)
+                if distance > self.max_distance:
+                    continue
+                key = (distance, -self.frequencies[candidate])
+                if best is None or key < best[0]:
+                    best = (key, candidate)
+        return None if best is None else best[1]
+
+    def unknown_words(self, text: str) -> list[str]:
+        # Words that are not exact dictionary hits. Letters mixed with digits
+        # are likely OCR confusions (0/O, 1/l) and always count as unknown.
+        return [
+            word
+            for word in _WORD_PATTERN.findall(text)
+            if not word.isdigit() and (any(c.isdigit() for c in word) or not self.is_known(word))
+        ]
+
+    def suggestions(self, text: str) -> dict[str, str]:
+        # Closest dictionary word for each unknown word that has one, as
+        # hints for the LLM rather than corrections.
+        suggestions = {}
+        for word in self.unknown_words(text):
+            suggestion = self.lookup(word)
+            if suggestion is not None and suggestion != word.casefold():
+                suggestions[word] = suggestion
+        return suggestions
+
+
+@lru_cache(maxsize=1)
+def get_spelling_index() -> SpellingIndex | None:
+    if not os.path.exists(SPELLING_DICTIONARY_PATH):
+        logger.warning(f"No spelling dictionary at {SPELLING_DICTIONARY_PATH}")
+        return None
+    logger.info(f"Building spelling index from {SPELLING_DICTIONARY_PATH}")
+    return SpellingIndex.from_file(SPELLING_DICTIONARY_PATH)
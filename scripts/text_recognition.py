@@ -1,6 +1,12 @@
 import base64
+import io
 import json
+import math
 import os
+import threading
+import time
+from collections.abc import Iterator
+from functools import lru_cache
 import easyocr
 import numpy as np
 from PIL import Image, ImageDraw
@@ -10,13 +16,27 @@ from dotenv import load_dotenv
 from loguru import logger
 
 from schema import (
+    LineBox,
     TextBlockWithFontSize,
-    TextBlockWithFontSizeAndLineSpacing,
-    TextBlockWithAlignment,
     ImageText,
-    TextBlockWithFontName,
     AnalyzedImage,
-    TextBlockWithFontNameAndColor,
+)
+from block_table import BlockTable
+from incremental import fingerprint_blocks
+from hedging import HEDGE_POLICIES, HEDGING_ENABLED, HedgeCancelled, hedged_call
+from json_stream import iter_json_array
+from layout_guides import find_guides
+from image_context import ImageContext, image_context
+from metrics import RETRIES, Counter, provider_timed
+from profiling import StageThreadPoolExecutor
+from spelling import get_spelling_index
+from ocr_cpu import configure_cpu_threads, cpu_profile_enabled, reader_kwargs
+from ocr_service import OCRServiceError, detect_text_remote, is_service_available
+from ocr_tiling import (
+    fits_one_tile,
+    read_text_adaptive,
+    read_working,
+    working_resolution,
 )
 
 load_dotenv()
@@ -28,50 +48,194 @@ openai_client = OpenAI(
     api_key=os.getenv("OPENAI_API_KEY"),
 )
 
+ATTRIBUTE_MODE = os.getenv("ATTRIBUTE_MODE", "image")
+ATTRIBUTE_FAN_OUT = int(os.getenv("ATTRIBUTE_FAN_OUT", "4"))
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "0") == "1"
+STREAM_MAX_ATTEMPTS = 3
+LOCAL_CORRECTION_CONFIDENCE = float(os.getenv("LOCAL_CORRECTION_CONFIDENCE", "0.9"))
+
 
-def analyze_image(image_path: str) -> AnalyzedImage:
+def analyze_image(image_path: str | ImageContext) -> AnalyzedImage:
+    # Every step below reads pixels and encodings through one shared context.
+    image_path = image_context(image_path)
     result = recognize_text(image_path)
 
-    merged_blocks = merge_text_blocks(result.text_blocks)
+    table = BlockTable.from_blocks(result.text_blocks)
+    table = merge_text_blocks(table)
 
-    blocks_with_line_spacing = calculate_line_spacing(merged_blocks)
+    calculate_line_spacing(table)
 
-    corrected_blocks = correct_text_with_llm(image_path, blocks_with_line_spacing)
-    blocks_with_alignment = identify_text_alignment(image_path, corrected_blocks)
-    blocks_with_font_name = identify_text_font_name(image_path, blocks_with_alignment)
-    blocks_with_color = identify_text_color(image_path, blocks_with_font_name)
+    if ATTRIBUTE_MODE == "crops" and STREAM_RESPONSES:
+        table = analyze_blocks_streaming(image_path, table)
+    elif ATTRIBUTE_MODE == "crops":
+        table = correct_text_with_llm(image_path, table)
+        table = identify_block_attributes(image_path, table)
+    else:
+        table = correct_text_with_llm(image_path, table)
+        table = identify_text_alignment(image_path, table)
+        table = identify_text_font_name(image_path, table)
+        table = identify_text_color(image_path, table)
 
-    width, height = Image.open(image_path).size
+    guides = find_guides(table)
+    text_blocks = table.to_blocks()
     analyzed_image = AnalyzedImage(
-        width=width,
-        height=height,
-        text_blocks=blocks_with_color,
+        width=result.width,
+        height=result.height,
+        text_blocks=text_blocks,
+        block_fingerprints=fingerprint_blocks(image_path, text_blocks),
+        guides=guides,
     )
     return analyzed_image
 
 
-def recognize_text(image_path: str) -> ImageText:
-    image = Image.open(image_path)
-    width, height = image.size
-    text_blocks = detect_text(image)
-    return ImageText(width=width, height=height, text_blocks=text_blocks)
+def recognize_text(image_path: str | ImageContext) -> ImageText:
+    context = image_context(image_path)
+    text_blocks = detect_text(context.rgb)
+    return ImageText(width=context.width, height=context.height, text_blocks=text_blocks)
+
+
+OCR_LANGUAGES = ["en"]
+
+
+@lru_cache(maxsize=1)
+def _load_reader() -> easyocr.Reader:
+    logger.info(f"Loading EasyOCR reader for {OCR_LANGUAGES}")
+    if cpu_profile_enabled():
+        configure_cpu_threads()
+    return easyocr.Reader(OCR_LANGUAGES, **reader_kwargs())
+
+
+OCR_READER_LOOKUPS = Counter(
+    "clone_ocr_reader_lookups_total",
+    "EasyOCR reader lookups by process (local or the OCR service) and state "
+    "(cold = reader loaded)",
+)
+
+
+def _get_reader() -> easyocr.Reader:
+    state = "warm" if _load_reader.cache_info().currsize else "cold"
+    reader = _load_reader()
+    OCR_READER_LOOKUPS.inc(process="local", state=state)
+    return reader
 
 
 def detect_text(image: Image) -> list[TextBlockWithFontSize]:
-    text_blocks = []
-    reader = easyocr.Reader(["en"])
-    results = reader.readtext(np.array(image))
+    if is_service_available():
+        try:
+            text_blocks = detect_text_remote(image)
+            # The service loads its reader at startup, so its lookups are
+            # always warm.
+            OCR_READER_LOOKUPS.inc(process="service", state="warm")
+            return text_blocks
+        except (OSError, OCRServiceError) as e:
+            logger.warning(f"OCR service failed, using local reader: {e}")
+    return detect_text_local(image)
+
+
+def detect_text_local(image: Image.Image | np.ndarray) -> list[TextBlockWithFontSize]:
+    results = read_text_adaptive(_get_reader(), image)
+    return _results_to_text_blocks(results)
+
+
+OCR_BATCH_BUCKET = 256
+OCR_BATCH_SIZE = 8
 
+
+def _size_bucket(width: int, height: int) -> tuple[int, int]:
+    return (
+        math.ceil(width / OCR_BATCH_BUCKET) * OCR_BATCH_BUCKET,
+        math.ceil(height / OCR_BATCH_BUCKET) * OCR_BATCH_BUCKET,
+    )
+
+
+def _rescale_results(results: list, scale_x: float, scale_y: float) -> list:
+    return [
+        ([[x * scale_x, y * scale_y] for x, y in bbox], text, prob)
+        for bbox, text, prob in results
+    ]
+
+
+def detect_text_batch(
+    images: list[Image.Image | np.ndarray],
+    batch_size: int = OCR_BATCH_SIZE,
+) -> list[list[TextBlockWithFontSize]]:
+    # Same results as detect_text_local: every image is probed for its
+    # working scale first, and only the resized images that fit one tile are
+    # batched, bucketed by their working size.
+    reader = _get_reader()
+    text_blocks: list[list[TextBlockWithFontSize] | None] = [None] * len(images)
+
+    working: dict[int, tuple[np.ndarray, float]] = {}
+    buckets: dict[tuple[int, int], list[int]] = {}
+    for i, image in enumerate(images):
+        array, scale = working_resolution(reader, image)
+        if not fits_one_tile(array):
+            text_blocks[i] = _results_to_text_blocks(read_working(reader, array, scale))
+            continue
+        working[i] = (array, scale)
+        height, width = array.shape[:2]
+        buckets.setdefault(_size_bucket(width, height), []).append(i)
+
+    for (bucket_width, bucket_height), indices in buckets.items():
+        logger.info(
+            f"OCR batch of {len(indices)} images in bucket {bucket_width}x{bucket_height}"
+        )
+        batch_results = reader.readtext_batched(
+            [working[i][0] for i in indices],
+            n_width=bucket_width,
+            n_height=bucket_height,
+            batch_size=batch_size,
+        )
+        for i, results in zip(indices, batch_results):
+            array, scale = working[i]
+            height, width = array.shape[:2]
+            results = _rescale_results(
+                results,
+                width / bucket_width / scale,
+                height / bucket_height / scale,
+            )
+            text_blocks[i] = _results_to_text_blocks(results)
+
+    return text_blocks
+
+
+def benchmark_detect_text_batch(
+    images: list[Image.Image | np.ndarray],
+    batch_sizes: tuple[int, ...] = (1, 2, 4, 8),
+) -> dict[int, float]:
+    images_per_second = {}
+    for batch_size in batch_sizes:
+        started = time.perf_counter()
+        for start in range(0, len(images), batch_size):
+            detect_text_batch(images[start : start + batch_size], batch_size)
+        elapsed = time.perf_counter() - started
+        images_per_second[batch_size] = len(images) / elapsed
+        logger.info(
+            f"OCR batch size {batch_size}: "
+            f"{images_per_second[batch_size]:.2f} images/s"
+        )
+    return images_per_second
+
+
+def _results_to_text_blocks(results: list) -> list[TextBlockWithFontSize]:
+    text_blocks = []
     for bbox, text, prob in results:
         if len(text) > 3:
             x1, y1 = bbox[0]
             x3, y3 = bbox[2]
             height = int(y3) - int(y1)
             font_size = _calculate_font_size(height)
+            bounding_box = [int(x1), int(y1), int(x3), int(y3)]
             text_block = TextBlockWithFontSize(
                 text=text,
-                bounding_box=[int(x1), int(y1), int(x3), int(y3)],
+                bounding_box=bounding_box,
                 font_size=font_size,
+                confidence=float(prob),
+                lines=[
+                    LineBox(
+                        text=text, bounding_box=bounding_box, confidence=float(prob)
+                    )
+                ],
             )
             text_blocks.append(text_block)
 
@@ -82,125 +246,90 @@ def _calculate_font_size(height: int) -> int:
     return int(height * 0.8)
 
 
-def merge_horizontally(
-    text_blocks: list[TextBlockWithFontSize], threshold: int = 10
-) -> list[TextBlockWithFontSize]:
-    if not text_blocks:
-        return []
-
-    blocks = text_blocks.copy()
+def _merge_table(
+    table: BlockTable,
+    can_merge,
+    order_axis: int,
+    separator: str,
+) -> BlockTable:
+    texts = list(table.texts)
+    boxes = table.boxes.copy()
+    font_sizes = table.font_sizes.copy()
+    confidences = table.confidences.copy()
+    lines = [list(block_lines) for block_lines in table.lines]
+    alive = np.ones(len(texts), dtype=bool)
     merged = True
 
     while merged:
         merged = False
-        i = 0
-        while i < len(blocks):
-            j = i + 1
-            while j < len(blocks):
-                block1 = blocks[i]
-                block2 = blocks[j]
-
-                x1_1, y1_1, x3_1, y3_1 = block1.bounding_box
-                x1_2, y1_2, x3_2, y3_2 = block2.bounding_box
-
-                x_overlap = x1_1 <= x3_2 and x1_2 <= x3_1
-                y_close_or_overlap = (
-                    y1_1 <= y3_2 + threshold and y1_2 <= y3_1 + threshold
-                )
-
-                if x_overlap and y_close_or_overlap:
-                    merged_x1 = min(x1_1, x1_2)
-                    merged_y1 = min(y1_1, y1_2)
-                    merged_x3 = max(x3_1, x3_2)
-                    merged_y3 = max(y3_1, y3_2)
-                    merged_font_size = min(block1.font_size, block2.font_size)
-
-                    if x1_1 > x1_2:
-                        merged_text = f"{block2.text} {block1.text}"
-                    else:
-                        merged_text = f"{block1.text} {block2.text}"
-
-                    merged_block = TextBlockWithFontSize(
-                        text=merged_text,
-                        bounding_box=[merged_x1, merged_y1, merged_x3, merged_y3],
-                        font_size=merged_font_size,
-                    )
-
-                    blocks[i] = merged_block
-                    blocks.pop(j)
-
-                    merged = True
+        for i in range(len(texts)):
+            if not alive[i]:
+                continue
+            # Like the list-based loop this replaced, scan forward from the
+            # last merged block rather than restarting at i + 1; blocks
+            # skipped earlier are picked up on the next pass.
+            start = i + 1
+            while True:
+                candidates = alive.copy()
+                candidates[:start] = False
+                matches = np.flatnonzero(candidates & can_merge(boxes[i], boxes))
+                if matches.size == 0:
+                    break
+                j = matches[0]
+                start = j + 1
+
+                if boxes[i, order_axis] > boxes[j, order_axis]:
+                    texts[i] = f"{texts[j]}{separator}{texts[i]}"
+                    lines[i] = lines[j] + lines[i]
                 else:
-                    j += 1
-
-            i += 1
-
-    return blocks
-
-
-def merge_vertically(
-    text_blocks: list[TextBlockWithFontSize], threshold: int = 10
-) -> list[TextBlockWithFontSize]:
-    if not text_blocks:
-        return []
+                    texts[i] = f"{texts[i]}{separator}{texts[j]}"
+                    lines[i] = lines[i] + lines[j]
+                boxes[i, :2] = np.minimum(boxes[i, :2], boxes[j, :2])
+                boxes[i, 2:] = np.maximum(boxes[i, 2:], boxes[j, 2:])
+                font_sizes[i] = min(font_sizes[i], font_sizes[j])
+                confidences[i] = min(confidences[i], confidences[j])
+                alive[j] = False
+
+                merged = True
+
+    keep = np.flatnonzero(alive)
+    return BlockTable(
+        texts=[texts[i] for i in keep],
+        boxes=boxes[keep],
+        font_sizes=font_sizes[keep],
+        ids=table.ids[keep],
+        confidences=confidences[keep],
+        lines=[lines[i] for i in keep],
+    )
 
-    blocks = text_blocks.copy()
-    merged = True
 
-    while merged:
-        merged = False
-        i = 0
-        while i < len(blocks):
-            j = i + 1
-            while j < len(blocks):
-                block1 = blocks[i]
-                block2 = blocks[j]
-
-                x1_1, y1_1, x3_1, y3_1 = block1.bounding_box
-                x1_2, y1_2, x3_2, y3_2 = block2.bounding_box
-
-                x_close_or_overlap = (
-                    x1_1 <= x3_2 + threshold or x1_2 <= x3_1 + threshold
-                )
-                y_close_or_overlap = (
-                    y1_1 <= y3_2 + threshold and y1_2 <= y3_1 + threshold
-                )
-
-                if x_close_or_overlap and y_close_or_overlap:
-                    merged_x1 = min(x1_1, x1_2)
-                    merged_y1 = min(y1_1, y1_2)
-                    merged_x3 = max(x3_1, x3_2)
-                    merged_y3 = max(y3_1, y3_2)
-                    merged_font_size = min(block1.font_size, block2.font_size)
-
-                    if y1_1 > y1_2:
-                        merged_text = f"{block2.text}\\n{block1.text}"
-                    else:
-                        merged_text = f"{block1.text}\\n{block2.text}"
-
-                    merged_block = TextBlockWithFontSize(
-                        text=merged_text,
-                        bounding_box=[merged_x1, merged_y1, merged_x3, merged_y3],
-                        font_size=merged_font_size,
-                    )
+def merge_horizontally(table: BlockTable, threshold: int = 10) -> BlockTable:
+    def can_merge(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+        x_overlap = (box[0] <= boxes[:, 2]) & (boxes[:, 0] <= box[2])
+        y_close_or_overlap = (box[1] <= boxes[:, 3] + threshold) & (
+            boxes[:, 1] <= box[3] + threshold
+        )
+        return x_overlap & y_close_or_overlap
 
-                    blocks[i] = merged_block
-                    blocks.pop(j)
+    return _merge_table(table, can_merge, order_axis=0, separator=" ")
 
-                    merged = True
-                else:
-                    j += 1
 
-            i += 1
+def merge_vertically(table: BlockTable, threshold: int = 10) -> BlockTable:
+    def can_merge(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+        x_close_or_overlap = (box[0] <= boxes[:, 2] + threshold) | (
+            boxes[:, 0] <= box[2] + threshold
+        )
+        y_close_or_overlap = (box[1] <= boxes[:, 3] + threshold) & (
+            boxes[:, 1] <= box[3] + threshold
+        )
+        return x_close_or_overlap & y_close_or_overlap
 
-    return blocks
+    return _merge_table(table, can_merge, order_axis=1, separator="\\n")
 
 
-def merge_text_blocks(
-    text_blocks: list[TextBlockWithFontSize], threshold: int = 10
-) -> list[TextBlockWithFontSize]:
-    # horizontal_merged = merge_horizontally(text_blocks, threshold)
-    vertical_merged = merge_vertically(text_blocks, threshold)
+def merge_text_blocks(table: BlockTable, threshold: int = 10) -> BlockTable:
+    # horizontal_merged = merge_horizontally(table, threshold)
+    vertical_merged = merge_vertically(table, threshold)
     # vertical_merged = merge_vertically(horizontal_merged, threshold)
     return vertical_merged
 
@@ -223,102 +352,354 @@ def draw_bounding_boxes(
     return output_path
 
 
-def _encode_image(image_path: str) -> tuple[str, str]:
-    with open(image_path, "rb") as image_file:
-        file_content = image_file.read()
-        encoded_content = base64.b64encode(file_content).decode("utf-8")
+def _encode_image(image_path: str | ImageContext) -> tuple[str, str]:
+    context = image_context(image_path)
+    return context.base64, context.media_type
 
-        if image_path.lower().endswith(".png"):
-            media_type = "image/png"
-        elif image_path.lower().endswith((".jpg", ".jpeg")):
-            media_type = "image/jpeg"
-        else:
-            media_type = "image/png"
 
-        return encoded_content, media_type
+CROP_PADDING = 16
+CROP_JPEG_QUALITY = 85
+CROPS_PROMPT = """
+    The image is given as crops, one per detected text, in the same order.
+    """
 
 
-def correct_text_with_llm(
+def _encode_crop(
+    image: Image.Image, box, padding: int = CROP_PADDING
+) -> tuple[str, str]:
+    x1, y1, x3, y3 = (int(value) for value in box)
+    width, height = image.size
+    crop = image.crop(
+        (
+            max(0, x1 - padding),
+            max(0, y1 - padding),
+            min(width, x3 + padding),
+            min(height, y3 + padding),
+        )
+    )
+    buffer = io.BytesIO()
+    crop.save(buffer, format="JPEG", quality=CROP_JPEG_QUALITY)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8"), "image/jpeg"
+
+
+def _encode_crops(image_path: str | ImageContext, table: BlockTable) -> list[tuple[str, str]]:
+    image = image_context(image_path).rgb
+    return [_encode_crop(image, box) for box in table.boxes]
+
+
+def _anthropic_images(image_path: str, table: BlockTable, crops: bool) -> list[dict]:
+    if crops:
+        images = _encode_crops(image_path, table)
+    else:
+        images = [_encode_image(image_path)]
+    return [
+        {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": media_type,
+                "data": image_data,
+            },
+        }
+        for image_data, media_type in images
+    ]
+
+
+def _openai_images(image_path: str, table: BlockTable, crops: bool) -> list[dict]:
+    if crops:
+        urls = [
+            f"data:{media_type};base64,{image_data}"
+            for image_data, media_type in _encode_crops(image_path, table)
+        ]
+    else:
+        urls = [_encode_image_for_openai(image_path)]
+    return [{"type": "image_url", "image_url": {"url": url}} for url in urls]
+
+
+def _claude_request(prompt: str, images: list[dict], max_tokens: int = 1024) -> dict:
+    return {
+        "model": "claude-3-5-sonnet-20241022",
+        "max_tokens": max_tokens,
+        "messages": [
+            {
+                "role": "user",
+                "content": [{"type": "text", "text": prompt}, *images],
+            },
+        ],
+    }
+
+
+@provider_timed("anthropic", "messages")
+def _ask_claude(prompt: str, images: list[dict], max_tokens: int = 1024) -> str:
+    response = client.messages.create(**_claude_request(prompt, images, max_tokens))
+    return response.content[0].text
+
+
+@provider_timed("anthropic", "messages_stream")
+def _ask_claude_stream(prompt: str, images: list[dict]) -> Iterator[str]:
+    with client.messages.stream(**_claude_request(prompt, images)) as stream:
+        yield from stream.text_stream
+
+
+def _openai_request(prompt: str, images: list[dict]) -> dict:
+    return {
+        "model": "gpt-4.5-preview",
+        "messages": [
+            {
+                "role": "user",
+                "content": [{"type": "text", "text": prompt}, *images],
+            },
+        ],
+    }
+
+
+@provider_timed("openai", "chat")
+def _ask_openai(prompt: str, images: list[dict]) -> str:
+    response = openai_client.chat.completions.create(**_openai_request(prompt, images))
+    return response.choices[0].message.content
+
+
+@provider_timed("openai", "chat_stream")
+def _ask_openai_stream(prompt: str, images: list[dict]) -> Iterator[str]:
+    with openai_client.chat.completions.create(
+        **_openai_request(prompt, images), stream=True
+    ) as chunks:
+        for chunk in chunks:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+_PROVIDERS = {
+    "anthropic": (_ask_claude, _ask_claude_stream, _anthropic_images),
+    "openai": (_ask_openai, _ask_openai_stream, _openai_images),
+}
+
+
+def _ask_cancellable(
+    provider: str,
+    prompt: str,
     image_path: str,
-    text_blocks: list[TextBlockWithFontSizeAndLineSpacing],
-) -> list[TextBlockWithFontSizeAndLineSpacing]:
+    table: BlockTable,
+    crops: bool,
+    cancel: threading.Event,
+) -> str:
+    _, ask_stream, images = _PROVIDERS[provider]
+    chunks = ask_stream(prompt, images(image_path, table, crops))
+    parts = []
+    try:
+        for chunk in chunks:
+            if cancel.is_set():
+                raise HedgeCancelled(provider)
+            parts.append(chunk)
+    finally:
+        # Closing the generator closes the provider's HTTP stream.
+        chunks.close()
+    return "".join(parts)
+
+
+def _covers_all_ids(response_text: str, key: str, count: int) -> bool:
+    ids = set()
+    for item in iter_json_array([response_text]):
+        try:
+            if key in item:
+                ids.add(int(item["id"]))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return ids >= set(range(count))
+
+
+def _hedged_chunks(
+    image_path: str,
+    table: BlockTable,
+    prompt: str,
+    key: str,
+    crops: bool,
+) -> list[str]:
+    def call(provider: str, cancel: threading.Event) -> str:
+        return _ask_cancellable(provider, prompt, image_path, table, crops, cancel)
+
+    def validate(response_text: str) -> bool:
+        return _covers_all_ids(response_text, key, len(table))
+
+    return [hedged_call(key, HEDGE_POLICIES[key], call, validate)]
+
+
+def _block_prompt(prompt: str, table: BlockTable, crops: bool) -> str:
+    text_data = [{"id": i, "text": text} for i, text in enumerate(table.texts)]
+    text_blocks_str = json.dumps(text_data)
+    prompt += f"Detected texts: {text_blocks_str}\n"
+    if crops:
+        prompt += CROPS_PROMPT
+    return prompt
+
+
+def _request_block_items(
+    image_path: str,
+    table: BlockTable,
+    prompt: str,
+    key: str,
+    provider: str,
+    crops: bool,
+    stream: bool,
+) -> Iterator[tuple[int, dict]]:
+    # Yields (row, item) as soon as each item of the JSON array is complete.
+    # Rows missing from a truncated or malformed response are re-requested.
+    ask, ask_stream, images = _PROVIDERS[provider]
+    pending = list(range(len(table)))
+
+    for _ in range(STREAM_MAX_ATTEMPTS):
+        if not pending:
+            return
+        sub_table = _rows_for_response(table, pending)
+        sub_prompt = _block_prompt(prompt, sub_table, crops)
+        if HEDGING_ENABLED and key in HEDGE_POLICIES:
+            chunks = _hedged_chunks(image_path, sub_table, sub_prompt, key, crops)
+        elif stream:
+            chunks = ask_stream(sub_prompt, images(image_path, sub_table, crops))
+        else:
+            chunks = [ask(sub_prompt, images(image_path, sub_table, crops))]
+
+        received = set()
+        for item in iter_json_array(chunks):
+            try:
+                position = int(item["id"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if key not in item or not 0 <= position < len(pending):
+                continue
+            row = pending[position]
+            if row not in received:
+                received.add(row)
+                yield row, item
+
+        pending = [row for row in pending if row not in received]
+        if not pending:
+            return
+        logger.warning(f"{key} response missing {len(pending)} blocks, re-requesting")
+        RETRIES.inc(kind="missing_blocks", stage=key)
+    logger.warning(f"no {key} for blocks {pending} after {STREAM_MAX_ATTEMPTS} attempts")
+
+
+def _apply_block_values(table: BlockTable, key: str, values: dict[int, str]) -> BlockTable:
+    rows = sorted(values)
+    result = _rows_for_response(table, rows)
+    if key == "text":
+        result.texts = [values[row] for row in rows]
+    else:
+        result.set_attribute(key, [values[row] for row in rows])
+    return result
+
+
+def stream_text_corrections(
+    image_path: str,
+    table: BlockTable,
+    crops: bool = False,
+    stream: bool = True,
+) -> Iterator[tuple[int, str]]:
     prompt = """
-    You will be given an image and list of detected texts.
+    You will be given an image and list of detected texts with their IDs.
     You need to correct the spelling and include "\n" for new lines.
     Only return the corrected text, no other text.
-    Return the corrected text in JSON format in the same order as the detected texts.
+    Return the corrected text in this JSON format:
     [
         {
-            "text": "corrected text",
+            "id": 0,
+            "text": "corrected text"
         },
         ...
     ]
+    Do not write any other text, don't write ```json or ```
     """
+    local_corrections = correct_text_locally(table)
+    for row, text in local_corrections.items():
+        yield row, text
+
+    llm_rows = [row for row in range(len(table)) if row not in local_corrections]
+    logger.info(
+        f"text correction: {len(local_corrections)} blocks accepted locally, "
+        f"{len(llm_rows)} sent to LLM"
+    )
+    hints = _spelling_hints(table, llm_rows)
+    if hints:
+        prompt += f"""
+    Closest dictionary words for words not in the dictionary, as hints only.
+    Brand names and ad copy are often near a dictionary word, so keep what
+    the image shows: {json.dumps(hints)}
+    """
+    items = _request_block_items(
+        image_path,
+        _rows_for_response(table, llm_rows),
+        prompt,
+        "text",
+        "anthropic",
+        crops,
+        stream,
+    )
+    for position, item in items:
+        logger.info(f"text correction for block {llm_rows[position]}: {item['text']}")
+        yield llm_rows[position], item["text"]
+
+
+def _spelling_hints(table: BlockTable, rows: list[int]) -> dict[str, str]:
+    spelling_index = get_spelling_index()
+    if spelling_index is None:
+        return {}
+    hints = {}
+    for row in rows:
+        hints.update(spelling_index.suggestions(table.texts[row].replace("\\n", "\n")))
+    return hints
+
+
+def correct_text_locally(
+    table: BlockTable,
+    min_confidence: float = LOCAL_CORRECTION_CONFIDENCE,
+) -> dict[int, str]:
+    # High-confidence blocks made only of dictionary words are accepted as
+    # read. Anything that would need a correction goes to the LLM, which can
+    # see the image and tell a brand name from a misread word.
+    spelling_index = get_spelling_index()
+    if spelling_index is None:
+        return {}
+    corrections = {}
+    for row, text in enumerate(table.texts):
+        if table.confidences[row] < min_confidence:
+            continue
+        text = text.replace("\\n", "\n")
+        unknown = spelling_index.unknown_words(text)
+        if unknown:
+            logger.debug(f"block {row} has unknown words {unknown}, sending to LLM")
+            continue
+        corrections[row] = text
+    return corrections
 
-    text_data = [{"text": block.text} for block in text_blocks]
-    text_blocks_str = json.dumps(text_data)
-    prompt += f"Detected texts: {text_blocks_str}\n"
-
-    image_data, media_type = _encode_image(image_path)
 
-    response = client.messages.create(
-        model="claude-3-5-sonnet-20241022",
-        max_tokens=1024,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": media_type,
-                            "data": image_data,
-                        },
-                    },
-                ],
-            },
-        ],
-    )
-    logger.info(f"text correction response: {response.content[0].text}")
-    response_json = json.loads(response.content[0].text)
-    logger.info(f"text correction response json: {response_json}")
-    corrected_blocks = []
-
-    for i, corrected_item in enumerate(response_json):
-        if i < len(text_blocks):
-            original_block = text_blocks[i].model_copy()
-            original_block_dump = original_block.model_dump()
-            original_block_dump.pop("text")
-            corrected_blocks.append(
-                TextBlockWithFontSizeAndLineSpacing(
-                    text=corrected_item["text"],
-                    **original_block_dump,
-                )
-            )
+def correct_text_with_llm(
+    image_path: str,
+    table: BlockTable,
+    crops: bool = False,
+    stream: bool = STREAM_RESPONSES,
+) -> BlockTable:
+    corrections = dict(stream_text_corrections(image_path, table, crops, stream))
+    return _apply_block_values(table, "text", corrections)
 
-    return corrected_blocks
 
+def _rows_for_response(table: BlockTable, ids) -> BlockTable:
+    ids = list(ids)
+    if ids == list(range(len(table))):
+        return table
+    return table.take(ids)
 
-def _encode_image_for_openai(image_path: str) -> str:
-    if image_path.endswith(".png"):
-        media_type = "image/png"
-    elif image_path.endswith((".jpg", ".jpeg")):
-        media_type = "image/jpeg"
-    else:
-        media_type = "image/png"
 
-    with open(image_path, "rb") as image_file:
-        file_content = image_file.read()
-        encoded_content = base64.b64encode(file_content).decode("utf-8")
-        return f"data:{media_type};base64,{encoded_content}"
+def _encode_image_for_openai(image_path: str | ImageContext) -> str:
+    return image_context(image_path).data_url
 
 
 def identify_text_alignment(
     image_path: str,
-    text_blocks: list[TextBlockWithFontSizeAndLineSpacing],
-) -> list[TextBlockWithAlignment]:
+    table: BlockTable,
+    crops: bool = False,
+    stream: bool = STREAM_RESPONSES,
+) -> BlockTable:
     prompt = """
     You will be given an image and list of detected texts with their IDs.
     Your task is to determine the text alignment of each text block: left or center.
@@ -335,50 +716,20 @@ def identify_text_alignment(
     Do not write any other text, don't write ```json or ```
     """
 
-    text_data = [{"id": i, "text": block.text} for i, block in enumerate(text_blocks)]
-    text_blocks_str = json.dumps(text_data)
-    prompt += f"Detected texts: {text_blocks_str}\n"
-
-    image_data = _encode_image_for_openai(image_path)
-
-    response = openai_client.chat.completions.create(
-        model="gpt-4.5-preview",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": image_data,
-                        },
-                    },
-                ],
-            },
-        ],
+    items = _request_block_items(
+        image_path, table, prompt, "alignment", "openai", crops, stream
     )
-    logger.info(f"text alignment response: {response.choices[0].message.content}")
-    response_json = json.loads(response.choices[0].message.content)
-    logger.info(f"text alignment response json: {response_json}")
-
-    result_blocks = []
-    for item in response_json:
-        text_id = int(item["id"])
-        original_text_block = text_blocks[text_id]
-        result_blocks.append(
-            TextBlockWithAlignment(
-                alignment=item["alignment"],
-                **original_text_block.model_dump(),
-            )
-        )
-    return result_blocks
+    values = {row: item["alignment"] for row, item in items}
+    logger.info(f"text alignment response: {values}")
+    return _apply_block_values(table, "alignment", values)
 
 
 def identify_text_font_name(
     image_path: str,
-    text_blocks: list[TextBlockWithFontSizeAndLineSpacing],
-) -> list[TextBlockWithFontName]:
+    table: BlockTable,
+    crops: bool = False,
+    stream: bool = STREAM_RESPONSES,
+) -> BlockTable:
     prompt = """
     You will be given an image and list of detected texts with their IDs.
     Your task is to determine the text font name of each text block.
@@ -394,50 +745,20 @@ def identify_text_font_name(
     Do not write any other text, don't write ```json or ```
     """
 
-    text_data = [{"id": i, "text": block.text} for i, block in enumerate(text_blocks)]
-    text_blocks_str = json.dumps(text_data)
-    prompt += f"Detected texts: {text_blocks_str}\n"
-
-    image_data = _encode_image_for_openai(image_path)
-
-    response = openai_client.chat.completions.create(
-        model="gpt-4.5-preview",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": image_data,
-                        },
-                    },
-                ],
-            },
-        ],
+    items = _request_block_items(
+        image_path, table, prompt, "font_name", "openai", crops, stream
     )
-    logger.info(f"text alignment response: {response.choices[0].message.content}")
-    response_json = json.loads(response.choices[0].message.content)
-    logger.info(f"text alignment response json: {response_json}")
-
-    result_blocks = []
-    for item in response_json:
-        text_id = int(item["id"])
-        original_text_block = text_blocks[text_id]
-        result_blocks.append(
-            TextBlockWithFontName(
-                font_name=item["font_name"],
-                **original_text_block.model_dump(),
-            )
-        )
-    return result_blocks
+    values = {row: item["font_name"] for row, item in items}
+    logger.info(f"text font name response: {values}")
+    return _apply_block_values(table, "font_name", values)
 
 
 def identify_text_color(
     image_path: str,
-    text_blocks: list[TextBlockWithFontSizeAndLineSpacing],
-) -> list[TextBlockWithFontNameAndColor]:
+    table: BlockTable,
+    crops: bool = False,
+    stream: bool = STREAM_RESPONSES,
+) -> BlockTable:
     prompt = """
     You will be given an image and list of detected texts with their IDs.
     Your task is to determine the text color of each text block.
@@ -452,74 +773,110 @@ def identify_text_color(
     Do not write any other text, don't write ```json or ```
     """
 
-    text_data = [{"id": i, "text": block.text} for i, block in enumerate(text_blocks)]
-    text_blocks_str = json.dumps(text_data)
-    prompt += f"Detected texts: {text_blocks_str}\n"
+    items = _request_block_items(
+        image_path, table, prompt, "color", "openai", crops, stream
+    )
+    values = {row: item["color"] for row, item in items}
+    logger.info(f"text color response: {values}")
+    return _apply_block_values(table, "color", values)
 
-    image_data = _encode_image_for_openai(image_path)
 
-    response = openai_client.chat.completions.create(
-        model="gpt-4.5-preview",
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": image_data,
-                        },
-                    },
-                ],
-            },
-        ],
+def _identify_crop_attributes(text: str, crop_url: str) -> dict:
+    prompt = """
+    You will be given a crop of an image containing one text block and its text.
+    Your task is to determine the text alignment (left or center), the closest
+    match from the Google Fonts library and the text color.
+    Only return the information in this JSON format:
+    {
+        "alignment": "left" or "center",
+        "font_name": "font name",
+        "color": "hex color code"
+    }
+    Do not write any other text, don't write ```json or ```
+    """
+    prompt += f"Detected text: {json.dumps(text)}\n"
+
+    response_text = _ask_openai(
+        prompt, [{"type": "image_url", "image_url": {"url": crop_url}}]
     )
-    logger.info(f"text color response: {response.choices[0].message.content}")
-    response_json = json.loads(response.choices[0].message.content)
-    logger.info(f"text color response json: {response_json}")
-
-    result_blocks = []
-    for item in response_json:
-        text_id = int(item["id"])
-        original_text_block = text_blocks[text_id]
-        result_blocks.append(
-            TextBlockWithFontNameAndColor(
-                color=item["color"],
-                **original_text_block.model_dump(),
-            )
-        )
-    return result_blocks
+    logger.info(f"crop attributes response: {response_text}")
+    return json.loads(response_text)
+
+
+def identify_block_attributes(
+    image_path: str,
+    table: BlockTable,
+    max_workers: int = ATTRIBUTE_FAN_OUT,
+) -> BlockTable:
+    crop_urls = [
+        f"data:{media_type};base64,{image_data}"
+        for image_data, media_type in _encode_crops(image_path, table)
+    ]
+    with StageThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_identify_crop_attributes, table.texts, crop_urls))
 
+    for name in ("alignment", "font_name", "color"):
+        table.set_attribute(name, [result[name] for result in results])
+    return table
 
-def _block_line_spacing(text_block: TextBlockWithFontSize) -> int:
-    text = text_block.text
-    lines_count = text.count("\\n") + 1
 
-    if lines_count <= 1:
-        return 0
+def analyze_blocks_streaming(
+    image_path: str,
+    table: BlockTable,
+    max_workers: int = ATTRIBUTE_FAN_OUT,
+) -> BlockTable:
+    # Attribute requests for a block start as soon as its correction arrives.
+    crop_urls = [
+        f"data:{media_type};base64,{image_data}"
+        for image_data, media_type in _encode_crops(image_path, table)
+    ]
+    corrections = {}
+    futures = {}
+    with StageThreadPoolExecutor(max_workers=max_workers) as executor:
+        for row, text in stream_text_corrections(image_path, table, stream=True):
+            corrections[row] = text
+            futures[row] = executor.submit(
+                _identify_crop_attributes, text, crop_urls[row]
+            )
+        attributes = {row: future.result() for row, future in futures.items()}
 
-    _, y1, _, y3 = text_block.bounding_box
-    height = y3 - y1
-    avg_line_height = height / lines_count
-    line_spacing = avg_line_height - text_block.font_size
+    result = _apply_block_values(table, "text", corrections)
+    for name in ("alignment", "font_name", "color"):
+        result.set_attribute(name, [attributes[row][name] for row in sorted(corrections)])
+    return result
 
-    return int(line_spacing)
 
+def compare_attribute_modes(image_path: str, table: BlockTable) -> dict:
+    image_bytes = len(_encode_image_for_openai(image_path))
+    crop_bytes = sum(
+        len(image_data) for image_data, _ in _encode_crops(image_path, table)
+    )
+
+    started = time.perf_counter()
+    whole_table = identify_text_alignment(image_path, table.take(range(len(table))))
+    whole_table = identify_text_font_name(image_path, whole_table)
+    whole_table = identify_text_color(image_path, whole_table)
+    image_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    identify_block_attributes(image_path, table.take(range(len(table))))
+    crops_seconds = time.perf_counter() - started
+
+    report = {
+        "image": {"bytes": image_bytes * 3, "requests": 3, "seconds": image_seconds},
+        "crops": {"bytes": crop_bytes, "requests": len(table), "seconds": crops_seconds},
+    }
+    logger.info(
+        f"attribute modes for {image_path}: "
+        f"image {report['image']['bytes']} B in {image_seconds:.2f}s, "
+        f"crops {crop_bytes} B in {crops_seconds:.2f}s"
+    )
+    return report
 
-def calculate_line_spacing(
-    text_blocks: list[TextBlockWithFontSize],
-) -> list[TextBlockWithFontSize]:
-    blocks_with_line_spacing = []
-    for block in text_blocks:
-        line_spacing = _block_line_spacing(block)
-        blocks_with_line_spacing.append(
-            TextBlockWithFontSizeAndLineSpacing(
-                text=block.text,
-                bounding_box=block.bounding_box,
-                font_size=block.font_size,
-                line_spacing=line_spacing,
-            )
-        )
-    return blocks_with_line_spacing
 
+def calculate_line_spacing(table: BlockTable) -> BlockTable:
+    lines_count = np.array([text.count("\\n") + 1 for text in table.texts])
+    heights = table.boxes[:, 3] - table.boxes[:, 1]
+    line_spacing = np.trunc(heights / np.maximum(lines_count, 1) - table.font_sizes)
+    table.line_spacing = np.where(lines_count > 1, line_spacing, 0.0)
+    return table
@@ -0,0 +1,278 @@
+import argparse
+import json
+import math
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fal_client
+from loguru import logger
+from pydantic import BaseModel
+
+from compositor import render_analyzed_image
+from image_context import image_context
+from image_generation import (
+    FLUX_MAX_IMAGES_PER_REQUEST,
+    regenerate_image_variants_flux_dev_redux,
+)
+from main import (
+    CACHE_DIR,
+    HTML_MODE,
+    PIPELINE_STAGES,
+    _load_analysis,
+    load_or_analyze_image,
+    stage_analyze,
+    stage_erase,
+    stage_mask,
+    write_html,
+)
+from phash_index import PHASH_INDEX_PATH
+from schema import AnalyzedImage
+
+# "batched" asks for several images per redux request, "parallel" sends one
+# single-image request per variant concurrently.
+VARIANT_REDUX_MODE = os.getenv("VARIANT_REDUX_MODE", "batched")
+VARIANT_WORKERS = int(os.getenv("VARIANT_WORKERS", "4"))
+# fal bills Flux Dev Redux per output megapixel, rounded up.
+REDUX_COST_PER_MEGAPIXEL = float(os.getenv("REDUX_COST_PER_MEGAPIXEL", "0.025"))
+
+SHARED_STAGES = [
+    ("analyze", stage_analyze),
+    ("mask", stage_mask),
+    ("erase", stage_erase),
+]
+
+
+class VariantReport(BaseModel):
+    output_dir: str
+    redux_seconds: float
+    assemble_seconds: float
+    cost_usd: float
+
+
+class VariantsReport(BaseModel):
+    redux_mode: str
+    shared_seconds: float
+    redux_requests: int
+    total_seconds: float
+    total_cost_usd: float
+    variants: list[VariantReport]
+
+    @property
+    def seconds_per_variant(self) -> float:
+        return self.total_seconds / len(self.variants) if self.variants else 0.0
+
+
+def redux_cost(width: int, height: int) -> float:
+    return math.ceil(width * height / 1_000_000) * REDUX_COST_PER_MEGAPIXEL
+
+
+def _redux_output_cost(output_dir: str) -> float:
+    # Billed on the image the request actually returned.
+    width, height = image_context(os.path.join(output_dir, "regenerated.png")).size
+    return redux_cost(width, height)
+
+
+def _check_num_variants(num_variants: int):
+    if num_variants < 1:
+        raise ValueError(f"num_variants must be at least 1, got {num_variants}")
+
+
+def _variant_dir(output_dir: str, index: int) -> str:
+    return os.path.join(output_dir, f"variant_{index:02d}")
+
+
+def _regenerate_variants(
+    cleaned_image_path: str,
+    variant_dirs: list[str],
+    redux_mode: str,
+) -> tuple[list[float], int]:
+    # Returns each variant's redux latency and the number of requests sent.
+    output_paths = [os.path.join(d, "regenerated.png") for d in variant_dirs]
+    image_url = fal_client.upload_file(cleaned_image_path)
+    if redux_mode == "batched":
+        chunk_size = FLUX_MAX_IMAGES_PER_REQUEST
+    elif redux_mode == "parallel":
+        chunk_size = 1
+    else:
+        raise ValueError(f"Unknown redux mode: {redux_mode}")
+    chunks = [
+        output_paths[start : start + chunk_size]
+        for start in range(0, len(output_paths), chunk_size)
+    ]
+
+    def run_chunk(chunk: list[str]) -> float:
+        started = time.perf_counter()
+        regenerate_image_variants_flux_dev_redux(cleaned_image_path, chunk, image_url)
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=min(len(chunks), VARIANT_WORKERS)) as executor:
+        chunk_seconds = list(executor.map(run_chunk, chunks))
+    latencies = [
+        seconds for chunk, seconds in zip(chunks, chunk_seconds) for _ in chunk
+    ]
+    return latencies, len(chunks)
+
+
+def _assemble_variant(
+    analyzed_image: AnalyzedImage, variant_dir: str, shared_html_path: str | None
+) -> float:
+    started = time.perf_counter()
+    if shared_html_path is not None:
+        shutil.copy(shared_html_path, os.path.join(variant_dir, "index.html"))
+    else:
+        write_html(analyzed_image, variant_dir)
+    render_analyzed_image(
+        analyzed_image,
+        os.path.join(variant_dir, "regenerated.png"),
+        os.path.join(variant_dir, "composited.png"),
+    )
+    return time.perf_counter() - started
+
+
+def generate_variants(
+    image_path: str,
+    output_dir: str,
+    num_variants: int,
+    redux_mode: str = VARIANT_REDUX_MODE,
+    phash_index_path: str = PHASH_INDEX_PATH,
+) -> VariantsReport:
+    _check_num_variants(num_variants)
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+    for name, stage in SHARED_STAGES:
+        if name == "analyze":
+            load_or_analyze_image(image_path, output_dir, phash_index_path=phash_index_path)
+        else:
+            stage(image_path, output_dir)
+    shared_seconds = time.perf_counter() - started
+
+    variant_dirs = [_variant_dir(output_dir, i) for i in range(num_variants)]
+    for variant_dir in variant_dirs:
+        os.makedirs(variant_dir, exist_ok=True)
+    cleaned_image_path = os.path.join(output_dir, "cleaned.png")
+    redux_seconds, redux_requests = _regenerate_variants(
+        cleaned_image_path, variant_dirs, redux_mode
+    )
+
+    analyzed_image = _load_analysis(output_dir)
+    # LLM-generated HTML only references regenerated.png by relative path, so
+    # one generation serves every variant; static HTML inlines the background.
+    shared_html_path = None
+    if HTML_MODE != "static":
+        shared_html_path = write_html(analyzed_image, output_dir)
+    with ThreadPoolExecutor(max_workers=VARIANT_WORKERS) as executor:
+        assemble_seconds = list(
+            executor.map(
+                lambda d: _assemble_variant(analyzed_image, d, shared_html_path),
+                variant_dirs,
+            )
+        )
+
+    variants = [
+        VariantReport(
+            output_dir=variant_dir,
+            redux_seconds=redux,
+            assemble_seconds=assemble,
+            cost_usd=_redux_output_cost(variant_dir),
+        )
+        for variant_dir, redux, assemble in zip(variant_dirs, redux_seconds, assemble_seconds)
+    ]
+    report = VariantsReport(
+        redux_mode=redux_mode,
+        shared_seconds=shared_seconds,
+        redux_requests=redux_requests,
+        total_seconds=time.perf_counter() - started,
+        total_cost_usd=sum(variant.cost_usd for variant in variants),
+        variants=variants,
+    )
+    logger.info(
+        f"{num_variants} variants of {image_path} in {report.total_seconds:.2f}s "
+        f"({report.seconds_per_variant:.2f}s/variant, {redux_requests} redux requests, "
+        f"${report.total_cost_usd:.3f})"
+    )
+    return report
+
+
+def _naive_clone(image_path: str, output_dir: str) -> float:
+    # One full clone_image run with nothing reused: the analysis cache is
+    # the fresh output_dir and the pHash index is private to it, so neither
+    # earlier variants nor the shared cache/phash_index.json are consulted
+    # or written. Returns the redux cost of the run.
+    os.makedirs(output_dir, exist_ok=True)
+    load_or_analyze_image(
+        image_path, output_dir, phash_index_path=os.path.join(output_dir, "phash_index.json")
+    )
+    for name, stage in PIPELINE_STAGES:
+        if name != "analyze":
+            stage(image_path, output_dir)
+    return _redux_output_cost(output_dir)
+
+
+def compare_with_naive(image_path: str, output_dir: str, num_variants: int) -> dict:
+    # Runs the old loop of full clone_image calls next to generate_variants.
+    # Costs cover redux only, measured per request on each returned image.
+    _check_num_variants(num_variants)
+    started = time.perf_counter()
+    naive_cost = 0.0
+    for i in range(num_variants):
+        naive_dir = os.path.join(output_dir, "naive", f"variant_{i:02d}")
+        shutil.rmtree(naive_dir, ignore_errors=True)
+        naive_cost += _naive_clone(image_path, naive_dir)
+    naive_seconds = time.perf_counter() - started
+
+    # The fan-out arm starts from scratch too, or a second --compare would
+    # time its cached analysis and cleaned.png against fresh naive runs.
+    fan_out_dir = os.path.join(output_dir, "fan_out")
+    shutil.rmtree(fan_out_dir, ignore_errors=True)
+    report = generate_variants(
+        image_path,
+        fan_out_dir,
+        num_variants,
+        phash_index_path=os.path.join(fan_out_dir, "phash_index.json"),
+    )
+    comparison = {
+        "naive": {
+            "seconds": naive_seconds,
+            "seconds_per_variant": naive_seconds / num_variants,
+            "redux_requests": num_variants,
+            "shared_stage_runs": num_variants,
+            "cost_usd": naive_cost,
+        },
+        "fan_out": {
+            "seconds": report.total_seconds,
+            "seconds_per_variant": report.seconds_per_variant,
+            "redux_requests": report.redux_requests,
+            "shared_stage_runs": 1,
+            "cost_usd": report.total_cost_usd,
+        },
+    }
+    logger.info(
+        f"{num_variants} variants: naive {naive_seconds:.2f}s ${naive_cost:.3f}, "
+        f"fan-out {report.total_seconds:.2f}s ${report.total_cost_usd:.3f}"
+    )
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate variants of one creative")
+    parser.add_argument("image")
+    parser.add_argument("-n", "--num-variants", type=int, default=4)
+    parser.add_argument("--output", default=None)
+    parser.add_argument(
+        "--redux-mode", choices=("batched", "parallel"), default=VARIANT_REDUX_MODE
+    )
+    parser.add_argument(
+        "--compare", action="store_true", help="Also time the naive clone_image loop"
+    )
+    args = parser.parse_args()
+    output_dir = args.output or os.path.join(
+        CACHE_DIR, os.path.splitext(os.path.basename(args.image))[0] + "_variants"
+    )
+    if args.compare:
+        comparison = compare_with_naive(args.image, output_dir, args.num_variants)
+        logger.info(json.dumps(comparison, indent=2))
+    else:
+        report = generate_variants(args.image, output_dir, args.num_variants, args.redux_mode)
+        logger.info(report.model_dump_json(indent=2))